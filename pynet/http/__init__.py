@@ -1,6 +1,44 @@
 CHUNK_SIZE = 1024 * 50
+MIN_CHUNK_SIZE = 1024 * 16
+MAX_CHUNK_SIZE = 1024 * 1024
 PYNET_VERSION = "0.1.4"
+ROUTER_CACHE_SIZE = 1024
+CACHE_REVALIDATE = 1.0
+COMPRESS_LEVEL = 6
+MAX_RANGES = 16
+MAX_HEADER_SIZE = 64 * 1024
+MAX_HEADER_FIELDS = 100
+MAX_READ_BUFFER = 1024 * 1024
+WRITE_HIGH_WATER = 64 * 1024
+SPOOL_SIZE = 100 * 1024
+STREAM_BUFFER = 256 * 1024
+STREAM_DRAIN = 64 * 1024
+MAX_CHUNKED_BODY = 16 * 1024 * 1024
+WEBSOCKET_COPY_SIZE = 16 * 1024
+WEBSOCKET_NUMPY_SIZE = 64 * 1024
+WEBSOCKET_MAX_MESSAGE = 16 * 1024 * 1024
+WEBSOCKET_COMPRESS_SIZE = 256
+WEBSOCKET_QUEUE_SIZE = 100
+WEBSOCKET_PING_INTERVAL = 30.0
+WEBSOCKET_PONG_TIMEOUT = 10.0
+WEBSOCKET_HEARTBEAT_RESOLUTION = 1.0
+WEBSOCKET_COALESCE_SIZE = 64 * 1024
+SESSION_EXPIRE = 60
+SESSION_SWEEP_INTERVAL = 10.0
+MAX_SESSIONS = 100000
+MAX_SESSIONS_PER_ADDR = None
+HTTP_POOL_SIZE = 10
+HTTP_POOL_IDLE_TIMEOUT = 30.0
 
 HTTP_CONNECTION_ABORT = -1
 HTTP_CONNECTION_CONTINUE = 0
-HTTP_CONNECTION_UPGRADE = 1
\ No newline at end of file
+HTTP_CONNECTION_UPGRADE = 1
+
+WEBSOCKET_CLOSE_NORMAL = 1000
+WEBSOCKET_CLOSE_PROTOCOL_ERROR = 1002
+WEBSOCKET_CLOSE_INVALID_DATA = 1007
+WEBSOCKET_CLOSE_TOO_BIG = 1009
+
+WEBSOCKET_DROP_OLDEST = "drop_oldest"
+WEBSOCKET_DROP_NEWEST = "drop_newest"
+WEBSOCKET_DISCONNECT = "disconnect"
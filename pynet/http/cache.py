@@ -0,0 +1,205 @@
+import gzip
+import io
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from pynet.http import CACHE_REVALIDATE, COMPRESS_LEVEL
+from pynet.http.tools import get_mimetype, make_etag, is_compressible, accept_encoding
+
+
+class CachedFileView(io.RawIOBase):
+    def __init__(self, buffer):
+        io.RawIOBase.__init__(self)
+        self.view = memoryview(buffer)
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self.pos = offset
+        elif whence == 1:
+            self.pos += offset
+        elif whence == 2:
+            self.pos = len(self.view) + offset
+        self.pos = max(self.pos, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        start = min(self.pos, len(self.view))
+        if size is None or size < 0:
+            end = len(self.view)
+        else:
+            end = min(start + size, len(self.view))
+        self.pos = end
+        return self.view[start:end]
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def getbuffer(self):
+        return self.view
+
+
+class CachedFile:
+    def __init__(self, path, stat, data=None):
+        self.path = path
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.mimetype = get_mimetype(path)
+        self.etag = make_etag(self.mtime, self.size)
+        self.data = data
+        self.compressible = data is not None and is_compressible(self.mimetype)
+        self.variants = {}
+        self.checked = time.monotonic()
+
+    def nbytes(self):
+        if self.data is None:
+            return 0
+        size = len(self.data)
+        for variant in self.variants.values():
+            if variant is not None:
+                size += len(variant)
+        return size
+
+    def get_etag(self, encoding=None):
+        if encoding is None:
+            return self.etag
+        return self.etag[:-1] + "-" + encoding + '"'
+
+    def load_precompressed(self):
+        if not self.compressible:
+            return
+        try:
+            stat = os.stat(self.path + ".gz")
+        except OSError:
+            return
+        if stat.st_mtime < self.mtime:
+            return
+        with open(self.path + ".gz", "rb") as f:
+            self.variants["gzip"] = f.read()
+
+    def is_stale(self, stat):
+        return stat.st_mtime != self.mtime or stat.st_size != self.size
+
+    def open(self, encoding=None):
+        if self.data is None:
+            return open(self.path, "rb")
+        if encoding is not None:
+            return CachedFileView(self.variants[encoding])
+        return CachedFileView(self.data)
+
+
+def compress_variant(data, encoding, level=COMPRESS_LEVEL):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level)
+    if encoding == "deflate":
+        return zlib.compress(data, level)
+    raise ValueError("Unknown encoding", encoding)
+
+
+class CachedFilesManager:
+    def __init__(self, max_size=100, revalidate=CACHE_REVALIDATE, encodings=("gzip", "deflate"),
+                 compress_level=COMPRESS_LEVEL):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.max_size = max_size
+        self.revalidate = revalidate
+        self.encodings = encodings
+        self.compress_level = compress_level
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def budget(self):
+        return self.max_size*1024*1024
+
+    def get(self, path):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and now - entry.checked < self.revalidate:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry
+
+        stat = os.stat(path)
+        with self.lock:
+            if entry is not None and self.entries.get(path) is entry:
+                if not entry.is_stale(stat):
+                    entry.checked = now
+                    self.entries.move_to_end(path)
+                    self.hits += 1
+                    return entry
+                self.remove(path)
+            self.misses += 1
+
+        if stat.st_size > self.budget():
+            return CachedFile(path, stat)
+
+        with open(path, "rb") as f:
+            entry = CachedFile(path, stat, f.read())
+        entry.load_precompressed()
+
+        with self.lock:
+            if path in self.entries:
+                self.remove(path)
+            self.entries[path] = entry
+            self.size += entry.nbytes()
+            self.evict()
+        return entry
+
+    def negotiate(self, entry, codings):
+        if not entry.compressible:
+            return None
+        for encoding in self.encodings:
+            if accept_encoding(codings, encoding) and self.get_variant(entry, encoding) is not None:
+                return encoding
+        return None
+
+    def get_variant(self, entry, encoding):
+        if encoding in entry.variants:
+            return entry.variants[encoding]
+        variant = compress_variant(entry.data, encoding, self.compress_level)
+        if len(variant) >= len(entry.data):
+            variant = None
+        with self.lock:
+            if encoding in entry.variants:
+                return entry.variants[encoding]
+            entry.variants[encoding] = variant
+            if self.entries.get(entry.path) is entry and variant is not None:
+                self.size += len(variant)
+                self.entries.move_to_end(entry.path)
+                self.evict()
+        return variant
+
+    def evict(self):
+        while self.size > self.budget() and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, path):
+        entry = self.entries.pop(path)
+        self.size -= entry.nbytes()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "size": self.size}
@@ -1,48 +1,307 @@
+import asyncio
 import io
-import ssl
+import time
+from collections import deque
 
+from pynet.http import CHUNK_SIZE
+from pynet.http.exceptions import HTTPStreamEnd
 from pynet.http.header import HTTPRequestHeader, HTTPResponseHeader
-from pynet.http.tools import create_connection, split_request, get_header, get_data
+from pynet.http.pool import HTTPConnectionPool
+from pynet.http.tools import split_request, get_header, read_chunked
+
+
+class HTTPClientResponse:
+    def __init__(self, pool, connection, request, header):
+        self.pool = pool
+        self.connection = connection
+        self.header = header
+        self.code = header.code
+        self.fields = header.fields
+        self.length = None
+        self.chunked = False
+        self.empty = request == "HEAD" or header.code in ("204", "304") or header.code.startswith("1")
+        if not self.empty:
+            self.chunked = header.chunked()
+            if not self.chunked:
+                self.length = header.fields.get("Content-Length", default=None, data_type=int)
+        self.received = 0
+        self.pending = b''
+        self.body = self.read_body()
+        self.finished = False
+        self.released = False
+
+    async def read_body(self):
+        reader = self.connection.reader
+        if self.empty:
+            return
+        if self.chunked:
+            async for data in read_chunked(reader):
+                yield data
+            return
+        remaining = self.length
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            data = await reader.read(size)
+            if not data:
+                if remaining is None:
+                    return
+                raise HTTPStreamEnd()
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+    async def next_chunk(self):
+        if self.pending:
+            data, self.pending = self.pending, b''
+            return data
+        if self.finished:
+            return b''
+        try:
+            data = await self.body.__anext__()
+        except StopAsyncIteration:
+            self.finished = True
+            self.release(self.length is not None or self.chunked or self.empty)
+            return b''
+        except BaseException:
+            self.finished = True
+            self.release(False)
+            raise
+        self.received += len(data)
+        return data
+
+    async def iter_chunks(self):
+        while True:
+            data = await self.next_chunk()
+            if not data:
+                return
+            yield data
+
+    async def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view):
+            data = await self.next_chunk()
+            if not data:
+                break
+            size = min(len(data), len(view) - filled)
+            view[filled:filled + size] = data[:size]
+            if size < len(data):
+                self.pending = data[size:]
+            filled += size
+        return filled
+
+    async def read(self):
+        data = bytearray()
+        async for chunk in self.iter_chunks():
+            data += chunk
+        return bytes(data)
+
+    async def save_to(self, path):
+        size = 0
+        with open(path, "wb") as f:
+            async for chunk in self.iter_chunks():
+                f.write(chunk)
+                size += len(chunk)
+        return size
+
+    def release(self, reuse=True):
+        if not self.released:
+            self.released = True
+            self.pool.release(self.connection, reuse and self.header.keep_alive())
+
+    def close(self):
+        self.finished = True
+        self.pending = b''
+        self.release(False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class HTTPFetchResult:
+    def __init__(self, index, request, url):
+        self.index = index
+        self.request = request
+        self.url = url
+        self.header = None
+        self.data = None
+        self.error = None
+        self.elapsed = None
+
+    def ok(self):
+        return self.error is None
+
+    def __str__(self):
+        status = self.header.code if self.header is not None else repr(self.error)
+        return "HTTPFetchResult(" + self.request + " " + self.url + " " + str(status) + ")"
+
+
+class HTTPHostStats:
+    def __init__(self, samples=1000):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.latencies = deque(maxlen=samples)
+
+    def add(self, elapsed, error=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total += elapsed
+        self.min = elapsed if self.min is None else min(self.min, elapsed)
+        self.max = elapsed if self.max is None else max(self.max, elapsed)
+        self.latencies.append(elapsed)
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    def __str__(self):
+        return "HTTPHostStats(count=" + str(self.count) + ", errors=" + str(self.errors) + \
+               ", mean=" + str(self.mean()) + ", p95=" + str(self.percentile(95)) + ")"
 
 
 class HTTPClient:
-    def __init__(self):
-        pass
+    def __init__(self, pool=None):
+        if pool is None:
+            pool = HTTPConnectionPool()
+        self.pool = pool
+        self.stats = {}
 
-    async def request(self, request, url, data=None):
+    async def stream(self, request, url, data=None):
         scheme, host, url = split_request(url)
         header = HTTPRequestHeader().new(url, request)
-        reader, writer = await create_connection(host, http_type=scheme)
         header.fields.set("Content-Length", 0)
         header.fields.set("Host", host)
-        header.fields.set("Connection", "close")
+        header.fields.set("Connection", "keep-alive")
         if data:
             header.fields.set("Content-Length", data.get_size())
             header.fields.set("Content-Type", data.get_content_type())
 
-        writer.write(str(header).encode())
-        await writer.drain()
+        connection = await self.pool.acquire(scheme, host)
+        try:
+            try:
+                response_header = await self.send(connection, header, data)
+            except (ConnectionError, HTTPStreamEnd):
+                if not connection.reused:
+                    raise
+                connection = await self.pool.replace(connection)
+                response_header = await self.send(connection, header, data)
+        except BaseException:
+            self.pool.release(connection, False)
+            raise
+
+        return HTTPClientResponse(self.pool, connection, request, response_header)
+
+    async def request(self, request, url, data=None):
+        async with await self.stream(request, url, data) as response:
+            body = io.BytesIO(await response.read())
+        return response.header, body
+
+    async def send(self, connection, header, data):
+        writer = connection.writer
+        writer.write(bytes(header))
         if data:
-            for chunk in data.read_chunk(5*1024):
+            for chunk in data.read(CHUNK_SIZE):
                 writer.write(chunk)
                 await writer.drain()
+        await writer.drain()
+        return await get_header(connection.reader, HTTPResponseHeader)
 
-        header = await get_header(reader, HTTPResponseHeader)
+    async def fetch_many(self, requests, concurrency=10, per_host=None, timeout=None, ordered=False,
+                         fail_fast=False):
+        requests = iter(requests)
+        host_slots = {}
+        running = set()
+        finished = {}
+        index = 0
+        next_index = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(running) < concurrency and index - next_index < concurrency:
+                    try:
+                        request = next(requests)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    running.add(asyncio.ensure_future(self.fetch(index, request, timeout, per_host, host_slots)))
+                    index += 1
+                if not running:
+                    return
+
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if fail_fast and result.error is not None:
+                        raise result.error
+                    if ordered:
+                        finished[result.index] = result
+                    else:
+                        next_index += 1
+                        yield result
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in running:
+                task.cancel()
 
-        data = io.BytesIO()
-        await get_data(reader, data, header.fields.get("Content-Length", default=None, data_type=int))
-        data.seek(0)
+    async def fetch(self, index, request, timeout=None, per_host=None, host_slots=None):
+        data = None
+        if isinstance(request, str):
+            request, url = "GET", request
+        elif len(request) == 2:
+            request, url = request
+        else:
+            request, url, data = request
 
-        writer.close()
+        result = HTTPFetchResult(index, request, url)
+        host = split_request(url)[1]
+        slots = None
+        if per_host is not None:
+            slots = host_slots.get(host)
+            if slots is None:
+                slots = asyncio.Semaphore(per_host)
+                host_slots[host] = slots
+            await slots.acquire()
+
+        start = time.monotonic()
         try:
-            await writer.wait_closed()
-        except ssl.SSLError:
-            pass
+            result.header, result.data = await asyncio.wait_for(self.request(request, url, data), timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            result.error = exc
+        finally:
+            if slots is not None:
+                slots.release()
+        result.elapsed = time.monotonic() - start
 
-        return header, data
+        stats = self.stats.get(host)
+        if stats is None:
+            stats = HTTPHostStats()
+            self.stats[host] = stats
+        stats.add(result.elapsed, result.error is not None)
+        return result
 
     async def get(self, url):
         return await self.request('GET', url)
 
     async def post(self, url, data):
-        return await self.request("POST", url, data=data)
\ No newline at end of file
+        return await self.request("POST", url, data=data)
+
+    def close(self):
+        self.pool.close()
@@ -1,47 +1,55 @@
+import asyncio
 import codecs
 import io
 import json
 import os
 import uuid
-from tempfile import NamedTemporaryFile
+from collections import deque
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
 
-from pynet.http.exceptions import HTTPError
+from pynet.http import SPOOL_SIZE, STREAM_BUFFER, STREAM_DRAIN, MAX_HEADER_SIZE
+from pynet.http.exceptions import HTTPError, HTTPStreamEnd
 from pynet.http.header import HTTPFields
-from pynet.http.tools import get_mimetype, get_file_length
+from pynet.http.tools import get_mimetype, get_file_length, parse_header_params
 
 
 class HTTPData:
-    def __init__(self, size):
+    def __init__(self, size, spool_size=SPOOL_SIZE, spool_dir=None, max_size=None):
         self.size = size
+        self.max_size = max_size
         self.current_size = 0
 
-        if self.size > 100 * 1024:
-            self.data_stream = NamedTemporaryFile(mode="w+b")
+        if self.size is None:
+            self.data_stream = SpooledTemporaryFile(max_size=spool_size, mode="w+b", dir=spool_dir)
+        elif self.size > spool_size:
+            self.data_stream = NamedTemporaryFile(mode="w+b", dir=spool_dir)
         else:
             self.data_stream = io.BytesIO()
 
     def io_size(self):
-        if isinstance(self.data_stream, io.BytesIO):
-            return self.data_stream.getbuffer().nbytes
-        else:
-            return os.stat(self.data_stream.name).st_size
+        return self.current_size
 
     def completed(self):
-        return self.io_size() == self.size
+        return self.current_size == self.size
 
     def feed(self, data):
-        if self.io_size()+len(data) > self.size:
+        limit = self.size if self.size is not None else self.max_size
+        if limit is not None and self.current_size+len(data) > limit:
             raise HTTPError(413)
         self.data_stream.write(data)
+        self.current_size += len(data)
 
         if self.completed():
             self.seek()
 
+    def end(self):
+        self.seek()
+
     def close(self):
         self.data_stream.close()
 
     def __str__(self):
-        return "HTTPData(size=" + str(os.fstat(self.data_stream.fileno()).st_size) + "/" + \
+        return "HTTPData(size=" + str(self.current_size) + "/" + \
                str(self.size) + \
                ", completed=" + str(self.completed()) + ")"
 
@@ -56,6 +64,282 @@ class HTTPData:
         return json.load(wrapper_file)
 
 
+class HTTPBodyStream:
+    def __init__(self, size=None, max_size=None, max_buffer=STREAM_BUFFER, max_drain=STREAM_DRAIN):
+        self.size = size
+        self.max_size = max_size
+        self.max_buffer = max_buffer
+        self.max_drain = max_drain
+        self.current_size = 0
+        self.chunks = deque()
+        self.buffered = 0
+        self.finished = False
+        self.draining = False
+        self.error = None
+        self.source = None
+        self.pump = None
+        self.read_waiter = None
+        self.write_waiter = None
+
+    @staticmethod
+    def wakeup(waiter):
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def feed(self, data):
+        limit = self.size if self.size is not None else self.max_size
+        if limit is not None and self.current_size+len(data) > limit:
+            raise HTTPError(413)
+        self.current_size += len(data)
+        if self.draining:
+            if self.current_size > self.max_drain:
+                raise HTTPStreamEnd()
+            return
+        self.chunks.append(data)
+        self.buffered += len(data)
+        self.wakeup(self.read_waiter)
+        while self.buffered > self.max_buffer and not self.finished:
+            self.write_waiter = asyncio.get_event_loop().create_future()
+            await self.write_waiter
+
+    def attach(self, source):
+        self.source = source
+
+    def start(self):
+        if self.pump is None:
+            self.pump = asyncio.ensure_future(self.pull())
+        return self.pump
+
+    async def pull(self):
+        try:
+            await self.source
+        except Exception as exc:
+            self.fail(exc)
+            raise
+        self.end()
+
+    async def drain(self):
+        self.draining = True
+        self.chunks.clear()
+        self.buffered = 0
+        self.wakeup(self.write_waiter)
+        self.max_drain += self.current_size
+        if self.size is not None and self.size > self.max_drain:
+            return False
+        try:
+            await self.start()
+        except Exception:
+            return False
+        return True
+
+    def stop(self):
+        if self.pump is None:
+            self.source.close()
+        elif not self.pump.done():
+            self.pump.cancel()
+            self.fail(HTTPStreamEnd())
+        elif not self.pump.cancelled():
+            self.pump.exception()
+
+    def end(self):
+        self.finished = True
+        self.wakeup(self.read_waiter)
+
+    def fail(self, error):
+        self.error = error
+        self.finished = True
+        self.wakeup(self.read_waiter)
+        self.wakeup(self.write_waiter)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        self.start()
+        while not self.chunks:
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                raise StopAsyncIteration
+            self.read_waiter = asyncio.get_event_loop().create_future()
+            await self.read_waiter
+        data = self.chunks.popleft()
+        self.buffered -= len(data)
+        if self.buffered <= self.max_buffer:
+            self.wakeup(self.write_waiter)
+        return data
+
+    async def read(self):
+        return b"".join([data async for data in self])
+
+
+class HTTPMultipartPart:
+    def __init__(self, fields):
+        self.fields = fields
+        _, params = parse_header_params(fields.get("Content-Disposition"))
+        self.name = params.get("name")
+        self.filename = params.get("filename")
+        self.content_type = fields.get("Content-Type", "text/plain")
+        self.size = 0
+        self.stream = None
+        self.path = None
+        self.owned = False
+        self.temporary = False
+
+    def is_file(self):
+        return self.filename is not None
+
+    def open(self, destination, upload_dir=None):
+        if destination is None:
+            if self.is_file():
+                self.stream = NamedTemporaryFile(mode="w+b", dir=upload_dir, delete=False)
+                self.path = self.stream.name
+                self.temporary = True
+            else:
+                self.stream = io.BytesIO()
+        elif isinstance(destination, str):
+            self.stream = open(destination, "wb")
+            self.path = destination
+            self.owned = True
+        else:
+            self.stream = destination
+
+    def write(self, data):
+        self.size += len(data)
+        self.stream.write(data)
+
+    def close(self):
+        if self.owned:
+            self.stream.close()
+        elif hasattr(self.stream, "seek"):
+            self.stream.flush()
+            self.stream.seek(0)
+
+    def claim(self):
+        self.temporary = False
+        return self.path
+
+    def discard(self):
+        if self.owned or self.temporary:
+            self.stream.close()
+        if self.temporary:
+            self.temporary = False
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def value(self):
+        if isinstance(self.stream, io.BytesIO):
+            return self.stream.getvalue().decode()
+
+    def __str__(self):
+        return "HTTPMultipartPart(name=" + str(self.name) + ", filename=" + str(self.filename) + \
+               ", size=" + str(self.size) + ")"
+
+
+class HTTPMultipartParser:
+    def __init__(self, boundary, on_part=None, max_part_size=None, upload_dir=None, max_size=None):
+        self.delimiter = b"\r\n--" + boundary.encode()
+        self.buffer = bytearray(b"\r\n")
+        self.state = "preamble"
+        self.on_part = on_part
+        self.max_part_size = max_part_size
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        self.current_size = 0
+        self.part = None
+        self.parts = []
+
+    def get(self, name):
+        for part in self.parts:
+            if part.name == name:
+                return part
+
+    def feed(self, data):
+        if self.max_size is not None and self.current_size+len(data) > self.max_size:
+            raise HTTPError(413)
+        self.current_size += len(data)
+        self.buffer += data
+        while self.parse():
+            pass
+
+    def parse(self):
+        if self.state in ("preamble", "body"):
+            end = self.buffer.find(self.delimiter)
+            if end < 0:
+                self.write(len(self.buffer) - len(self.delimiter) + 1)
+                return False
+            self.write(end)
+            del self.buffer[:len(self.delimiter)]
+            if self.part is not None:
+                self.part.close()
+                self.part = None
+            self.state = "delimiter"
+            return True
+
+        if self.state == "delimiter":
+            if self.buffer[:2] == b"--":
+                self.state = "end"
+                return False
+            end = self.buffer.find(b"\r\n")
+            if end < 0:
+                if len(self.buffer) > MAX_HEADER_SIZE:
+                    raise HTTPError(400)
+                return False
+            if self.buffer[:end].strip(b" \t"):
+                raise HTTPError(400)
+            del self.buffer[:end + 2]
+            self.state = "headers"
+            return True
+
+        if self.state == "headers":
+            if self.buffer[:2] == b"\r\n":
+                lines = []
+                del self.buffer[:2]
+            else:
+                end = self.buffer.find(b"\r\n\r\n")
+                if end < 0:
+                    if len(self.buffer) > MAX_HEADER_SIZE:
+                        raise HTTPError(400)
+                    return False
+                lines = bytes(self.buffer[:end]).split(b"\r\n")
+                del self.buffer[:end + 4]
+            fields = HTTPFields()
+            fields.parse(lines)
+            self.start_part(HTTPMultipartPart(fields))
+            self.state = "body"
+            return True
+
+        self.buffer.clear()
+        return False
+
+    def start_part(self, part):
+        destination = None
+        if self.on_part is not None:
+            destination = self.on_part(part)
+        part.open(destination, self.upload_dir)
+        self.part = part
+        self.parts.append(part)
+
+    def write(self, size):
+        if size <= 0:
+            return
+        if self.part is not None:
+            if self.max_part_size is not None and self.part.size + size > self.max_part_size:
+                raise HTTPError(413)
+            self.part.write(bytes(self.buffer[:size]))
+        del self.buffer[:size]
+
+    def end(self):
+        if self.state != "end":
+            raise HTTPError(400)
+
+    def close(self):
+        for part in self.parts:
+            part.discard()
+
+
 class HTTPMultipartSender:
     def __init__(self):
         self.list = []
@@ -81,7 +365,7 @@ class HTTPMultipartSender:
         tot_size = 0
         for field, data in self.list:
             tot_size += len("--"+self.boundary+"\r\n")
-            tot_size += len(str(field)+"\r\n")
+            tot_size += len(bytes(field)+b"\r\n")
             tot_size += get_file_length(data)
             tot_size += len("\r\n")
         tot_size += len("--"+self.boundary+"--")
@@ -90,7 +374,7 @@ class HTTPMultipartSender:
     def read(self, chunk_size):
         for field, bin_file in self.list:
             yield ("--" + self.boundary + "\r\n").encode()
-            yield str(field).encode()+"\r\n".encode()
+            yield bytes(field)+b"\r\n"
             bin_file.seek(0)
             while True:
                 data = bin_file.read(chunk_size)
@@ -104,3 +388,73 @@ class HTTPMultipartSender:
     def close(self):
         for _, bin_file in self.list:
             bin_file.close()
+
+
+class HTTPByteRangesSender:
+    def __init__(self, data, ranges, full_size, content_type):
+        self.data = data
+        self.boundary = "----pynet-------------------"+str(uuid.uuid4())
+        self.list = []
+        for start, end in ranges:
+            field = HTTPFields()
+            if content_type:
+                field.set("Content-Type", content_type)
+            field.set("Content-Range", "bytes "+str(start)+"-"+str(end)+"/"+str(full_size))
+            self.list.append((field, start, end))
+
+    def get_content_type(self):
+        return "multipart/byteranges; boundary="+self.boundary
+
+    def get_size(self):
+        tot_size = 0
+        for field, start, end in self.list:
+            tot_size += len("--"+self.boundary+"\r\n")
+            tot_size += len(bytes(field)+b"\r\n")
+            tot_size += end - start + 1
+            tot_size += len("\r\n")
+        tot_size += len("--"+self.boundary+"--\r\n")
+        return tot_size
+
+    def read(self, chunk_size):
+        for field, start, end in self.list:
+            yield ("--" + self.boundary + "\r\n").encode()
+            yield bytes(field)+b"\r\n"
+            self.data.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = self.data.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+            yield "\r\n".encode()
+
+        yield ("--" + self.boundary + "--\r\n").encode()
+
+    def close(self):
+        self.data.close()
+
+
+class HTTPStreamSender:
+    def __init__(self, source):
+        self.source = source
+
+    async def chunks(self):
+        if hasattr(self.source, "__aiter__"):
+            async for data in self.source:
+                yield self.encode(data)
+        else:
+            for data in self.source:
+                yield self.encode(data)
+
+    def encode(self, data):
+        if isinstance(data, str):
+            return data.encode()
+        return data
+
+    def get_content_type(self):
+        return "application/octet-stream"
+
+    def close(self):
+        if hasattr(self.source, "close"):
+            self.source.close()
@@ -9,3 +9,10 @@ class HTTPError(Exception):
 class HTTPStreamEnd(Exception):
     def __init__(self):
         Exception.__init__(self, "Close HTTPStream")
+
+
+class WebSocketError(Exception):
+    def __init__(self, code, reason=""):
+        Exception.__init__(self, "WebSocketError: "+str(code)+" "+reason)
+        self.code = code
+        self.reason = reason
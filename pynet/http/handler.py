@@ -5,17 +5,20 @@ import os
 import pythread
 
 from pynet.http import HTTP_CONNECTION_UPGRADE, HTTP_CONNECTION_CONTINUE
-from pynet.http.data import HTTPData, HTTPMultipartSender
+from pynet.http.data import HTTPData, HTTPBodyStream, HTTPMultipartSender, HTTPMultipartParser
 from pynet.http.exceptions import HTTPError
 from pynet.http.response import HTTPResponse
-from pynet.http.tools import get_mimetype
-from pynet.http.websocket import webSocket_process_key, WebSocketClient
+from pynet.http.tools import get_mimetype, make_etag, parse_accept_encoding, accept_encoding, parse_header_params
+from pynet.http.websocket import webSocket_process_key
 
 
 class HTTPHandler:
     handler_fields = []
     enable_session = False
     enable_range = False
+    stream_body = False
+    multipart_upload = False
+    max_part_size = None
     compression = None
 
     def __init__(self, header, args, addr, server):
@@ -30,6 +33,7 @@ class HTTPHandler:
 
         self.session = None
         self.data = None
+        self.body = None
         self.stream_handler = None
 
         if self.enable_session:
@@ -44,16 +48,30 @@ class HTTPHandler:
         self.response.render(200, template, **kwargs)
 
     def file(self, path, cached=True, attachment=False):
-        prevent_close = False
-        if not os.path.exists(path):
-            raise HTTPError(404)
         if cached:
-            prevent_close = True
-            _, data, content_type, _ = self.server.cached.get(path)
+            try:
+                entry = self.server.cached.get(path)
+            except FileNotFoundError:
+                raise HTTPError(404)
+            encoding = None
+            if self.compression and entry.compressible:
+                codings = parse_accept_encoding(self.header.fields.get("Accept-Encoding"))
+                encoding = self.server.cached.negotiate(entry, codings)
+                self.response.header.fields.set("Vary", "Accept-Encoding")
+                if encoding:
+                    self.response.header.fields.set("Content-Encoding", encoding)
+            data = entry.open(encoding)
+            content_type = entry.mimetype
+            etag, mtime = entry.get_etag(encoding), entry.mtime
         else:
+            if not os.path.exists(path):
+                raise HTTPError(404)
             data = open(path, "rb")
             content_type = get_mimetype(path)
-        self.response.file(200, data, content_type=content_type, prevent_close=prevent_close)
+            stat = os.fstat(data.fileno())
+            etag, mtime = make_etag(stat.st_mtime, stat.st_size), stat.st_mtime
+        self.response.file(200, data, content_type=content_type)
+        self.response.set_validators(etag, mtime)
         if attachment:
             self.response.header.fields.set("Content-Disposition", 'attachment; filename="'+os.path.basename(path)+'"')
 
@@ -82,30 +100,87 @@ class HTTPHandler:
         key = self.header.get_websocket_upgrade()
         if key and self.get_webSocket_room():
             key = webSocket_process_key(key)
-            self.upgrade(WebSocketClient(self.header, self.get_webSocket_room(), self.addr, self.server))
-            self.response.upgrade_websocket(key)
+            room = self.get_webSocket_room()
+            client = room.client_class(self.header, room, self.addr, self.server)
+            self.upgrade(client)
+            self.response.upgrade_websocket(key, client.extensions)
             return HTTP_CONNECTION_UPGRADE
 
         content_length = self.header.fields.get("Content-Length", 0, int)
-        if content_length > 0:
-            self.data = HTTPData(content_length)
+        chunked = self.header.chunked()
+        if not chunked and content_length == 0:
+            return HTTP_CONNECTION_CONTINUE
+        size = None if chunked else content_length
+        max_size = self.server.max_body_size
+        if chunked and max_size is None:
+            max_size = self.server.max_chunked_body
+        content_type, params = parse_header_params(self.header.fields.get("Content-Type"))
+        if self.multipart_upload and content_type == "multipart/form-data" and params.get("boundary"):
+            self.data = HTTPMultipartParser(params["boundary"], on_part=self.on_part,
+                                            max_part_size=self.max_part_size, upload_dir=self.server.spool_dir,
+                                            max_size=max_size)
+        elif self.stream_body:
+            self.body = HTTPBodyStream(size, max_size=max_size)
+        else:
+            self.data = HTTPData(size, spool_size=self.server.spool_size, spool_dir=self.server.spool_dir,
+                                 max_size=max_size)
         return HTTP_CONNECTION_CONTINUE
 
     async def prepare_response(self):
-        if self.compression == "gzip" and "gzip" in self.header.fields.get("Accept-Encoding").split(","):
-            self.response.compress_gzip()
+        if self.header.query in ("GET", "HEAD") and self.response.is_not_modified(self.header.fields):
+            self.response.not_modified()
+            self.response.set_length()
+            return self.response
+
+        if self.compression == "gzip":
+            codings = parse_accept_encoding(self.header.fields.get("Accept-Encoding"))
+            if accept_encoding(codings, "gzip"):
+                self.response.compress_gzip()
 
         if self.enable_range:
             self.response.header.enable_range("bytes")
-            self.response.set_length(self.header.fields.get("Range"))
+            rng = self.header.fields.get("Range")
+            if rng and not self.response.check_if_range(self.header.fields.get("If-Range")):
+                rng = None
+            self.response.set_length(rng)
         else:
             self.response.set_length()
 
         return self.response
 
     def write(self, data_chunk):
+        if self.body is not None:
+            return self.body.feed(data_chunk)
         self.data.feed(data_chunk)
 
+    def end_data(self):
+        if self.body is not None:
+            self.body.end()
+        elif isinstance(self.data, (HTTPData, HTTPMultipartParser)):
+            self.data.end()
+
+    def on_part(self, part):
+        return None
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+
+    async def process(self, receive):
+        if self.body is None:
+            await receive
+            self.end_data()
+            await self.execute_request()
+            return True
+
+        # the body is read when the handler iterates it; a leftover above STREAM_DRAIN closes the connection
+        self.body.attach(receive)
+        try:
+            await self.execute_request()
+            return await self.body.drain()
+        finally:
+            self.body.stop()
+
     def get_query_fct(self):
         if self.header.query == "GET":
             return self.GET
@@ -1,7 +1,8 @@
 from urllib.parse import urlparse, parse_qsl
 
+from pynet.http import MAX_HEADER_FIELDS
 from pynet.http.exceptions import HTTPError
-from pynet.http.tools import http_parse_query, http_parse_field, http_code_to_string, create_cookie
+from pynet.http.tools import http_parse_query, http_parse_field, http_split_head, http_code_to_string, create_cookie
 
 
 class HTTPResponseHeader:
@@ -12,21 +13,33 @@ class HTTPResponseHeader:
 
     def set_cookie(self, name, value, expire=None, **kwargs):
         finder = str(name)+"="+str(value)
-        for field in self.fields.fields:
-            if field[0] == "Set-Cookie" and field[1][:len(finder)] == finder:
-                self.fields.fields.remove(field)
+        for cookie in self.fields.get_all("Set-Cookie"):
+            if cookie[:len(finder)] == finder:
+                self.fields.remove("Set-Cookie", cookie)
         self.fields.append(("Set-Cookie", create_cookie(name, value, expire, **kwargs)))
 
     def enable_range(self, value):
         self.fields.set("Accept-Ranges", value)
 
+    def chunked(self):
+        return self.fields.has_token("Transfer-Encoding", "chunked")
+
+    def keep_alive(self):
+        if self.fields.has_token("Connection", "close"):
+            return False
+        return self.protocol == "HTTP/1.1" or self.fields.has_token("Connection", "keep-alive")
+
+    def parse(self, data):
+        start, lines = http_split_head(data)
+        self.protocol, self.code, _ = http_parse_query(start)
+        self.fields.parse(lines)
+        return self
+
     def parse_line(self, line):
         if self.code is None:
             self.protocol, self.code, _ = http_parse_query(line)
         else:
-            self.fields.append(http_parse_field(line))
-            if self.fields.length() > 100:
-                raise HTTPError(431)
+            self.fields.parse([line])
 
     def __str__(self):
         ret = self.protocol + " " + str(self.code) + " " + http_code_to_string(self.code) + "\r\n"
@@ -34,6 +47,9 @@ class HTTPResponseHeader:
         ret += "\r\n"
         return ret
 
+    def __bytes__(self):
+        return str(self).encode()
+
 
 class HTTPRequestHeader:
     def __init__(self):
@@ -54,13 +70,9 @@ class HTTPRequestHeader:
         return False
 
     def keep_alive(self):
-        connection = self.fields.get("Connection")
-        if not connection:
+        if self.fields.has_token("Connection", "close"):
             return False
-        connection = connection.split(', ')
-        if "keep-alive" in connection:
-            return True
-        return False
+        return self.protocol == "HTTP/1.1" or self.fields.has_token("Connection", "keep-alive")
 
     def upgraded(self):
         connection = self.fields.get("Connection")
@@ -82,18 +94,26 @@ class HTTPRequestHeader:
                     return data_type(cookie[1])
                 return cookie[1]
 
+    def chunked(self):
+        return self.fields.has_token("Transfer-Encoding", "chunked")
+
     def get_websocket_upgrade(self):
         if self.upgraded() and self.fields.get("Upgrade") == "websocket":
             return self.fields.get("Sec-WebSocket-Key")
 
+    def parse(self, data):
+        start, lines = http_split_head(data)
+        self.query, url, self.protocol = http_parse_query(start)
+        self.url = Url(url)
+        self.fields.parse(lines)
+        return self
+
     def parse_line(self, line):
         if self.query is None:
             self.query, url, self.protocol = http_parse_query(line)
             self.url = Url(url)
         else:
-            self.fields.append(http_parse_field(line))
-            if self.fields.length() > 100:
-                raise HTTPError(431)
+            self.fields.parse([line])
 
     def __str__(self):
         ret = str(self.query) + " " + str(self.url) + " " + str(self.protocol) + "\r\n"
@@ -101,41 +121,94 @@ class HTTPRequestHeader:
         ret += "\r\n"
         return ret
 
+    def __bytes__(self):
+        return str(self).encode()
+
 
 class HTTPFields:
     def __init__(self):
-        self.fields = []
+        self.entries = []
+        self.items = {}
 
     def length(self):
-        return len(self.fields)
+        return len(self.entries)
 
     def get(self, name, default=None, data_type=None):
-        for field_name, field_value in self.fields:
-            if field_name == name:
-                if not data_type:
-                    return field_value
-                else:
-                    return data_type(field_value)
-        return default
+        entries = self.items.get(name.lower())
+        if not entries:
+            return default
+        if not data_type:
+            return entries[0][1]
+        return data_type(entries[0][1])
+
+    def get_all(self, name):
+        return [entry[1] for entry in self.items.get(name.lower(), ())]
 
     def set(self, name, value):
-        for i in range(0, len(self.fields)):
-            if self.fields[i][0] == name:
-                self.fields[i] = (name, value)
-                return
-        self.fields.append((name, value))
+        entries = self.items.get(name.lower())
+        if not entries:
+            self.append((name, value))
+            return
+        entries[0][1] = value
+        if len(entries) > 1:
+            self.drop(name.lower(), entries[1:])
 
     def append(self, value):
-        self.fields.append(value)
+        name, value = value
+        entry = [name, value]
+        self.entries.append(entry)
+        self.items.setdefault(name.lower(), []).append(entry)
 
     def add_fields(self, fields):
-        self.fields += fields
+        for field in fields:
+            self.append(field)
+
+    def parse(self, lines, max_fields=MAX_HEADER_FIELDS):
+        for line in lines:
+            if not line:
+                continue
+            if len(self.entries) >= max_fields:
+                raise HTTPError(431)
+            self.append(http_parse_field(line))
+
+    def remove(self, name, value=None):
+        key = name.lower()
+        entries = self.items.get(key)
+        if not entries:
+            return
+        if value is not None:
+            entries = [entry for entry in entries if entry[1] == value]
+        self.drop(key, entries)
+
+    def drop(self, key, entries):
+        dropped = set(map(id, entries))
+        self.entries = [entry for entry in self.entries if id(entry) not in dropped]
+        kept = [entry for entry in self.items[key] if id(entry) not in dropped]
+        if kept:
+            self.items[key] = kept
+        else:
+            del self.items[key]
+
+    def has_token(self, name, token):
+        token = token.lower()
+        for value in self.get_all(name):
+            for el in value.split(","):
+                if el.strip().lower() == token:
+                    return True
+        return False
+
+    def __contains__(self, name):
+        return name.lower() in self.items
+
+    def __iter__(self):
+        for name, value in self.entries:
+            yield name, value
+
+    def __bytes__(self):
+        return str(self).encode()
 
     def __str__(self):
-        ret = ""
-        for field in self.fields:
-            ret += field[0] + ": " + str(field[1]) + "\r\n"
-        return ret
+        return "".join([name + ": " + str(value) + "\r\n" for name, value in self])
 
 
 class Url:
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from collections import deque
+
+from pynet.http import HTTP_POOL_SIZE, HTTP_POOL_IDLE_TIMEOUT
+from pynet.http.tools import create_connection, get_ssl_context, split_host
+
+
+class HTTPConnection:
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self.reused = False
+
+    def is_usable(self):
+        if self.writer.is_closing() or self.reader.at_eof() or self.reader.exception() is not None:
+            return False
+        return True
+
+    def idle_time(self):
+        return time.monotonic() - self.last_used
+
+    def close(self):
+        self.writer.close()
+
+
+class HTTPConnectionPool:
+    def __init__(self, max_per_host=HTTP_POOL_SIZE, idle_timeout=HTTP_POOL_IDLE_TIMEOUT, verify=True, cafile=None):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.sslctx = get_ssl_context(verify, cafile)
+        self.idle = {}
+        self.slots = {}
+        self.sessions = {}
+        self.loop = None
+        self.handle = None
+        self.created = 0
+        self.reused = 0
+        self.resumed = 0
+
+    def get_key(self, scheme, host):
+        host, port = split_host(host, scheme)
+        return scheme, host, port
+
+    def get_slots(self, key):
+        slots = self.slots.get(key)
+        if slots is None:
+            slots = asyncio.Semaphore(self.max_per_host)
+            self.slots[key] = slots
+        return slots
+
+    async def acquire(self, scheme, host):
+        key = self.get_key(scheme, host)
+        slots = self.get_slots(key)
+        await slots.acquire()
+        try:
+            connection = self.get_idle(key)
+            if connection is None:
+                connection = await self.connect(key)
+        except BaseException:
+            slots.release()
+            raise
+        return connection
+
+    def get_idle(self, key):
+        idle = self.idle.get(key)
+        while idle:
+            connection = idle.pop()
+            if connection.idle_time() < self.idle_timeout and connection.is_usable():
+                connection.reused = True
+                self.reused += 1
+                return connection
+            connection.close()
+        return None
+
+    async def connect(self, key):
+        scheme, host, port = key
+        reader, writer = await create_connection(host, port, http_type=scheme, sslctx=self.sslctx,
+                                                 session=self.sessions.get(key))
+        self.created += 1
+        ssl_object = writer.get_extra_info("ssl_object")
+        if ssl_object is not None and ssl_object.session_reused:
+            self.resumed += 1
+        return HTTPConnection(key, reader, writer)
+
+    def save_session(self, connection):
+        ssl_object = connection.writer.get_extra_info("ssl_object")
+        if ssl_object is not None and ssl_object.session is not None:
+            self.sessions[connection.key] = ssl_object.session
+
+    async def replace(self, connection):
+        connection.close()
+        return await self.connect(connection.key)
+
+    def release(self, connection, reuse=True):
+        self.get_slots(connection.key).release()
+        connection.requests += 1
+        connection.last_used = time.monotonic()
+        self.save_session(connection)
+        if reuse and connection.is_usable():
+            self.idle.setdefault(connection.key, deque()).append(connection)
+            self.schedule()
+        else:
+            connection.close()
+
+    def schedule(self):
+        if self.handle is None:
+            self.loop = asyncio.get_event_loop()
+            self.handle = self.loop.call_later(self.idle_timeout, self.run)
+
+    def run(self):
+        self.handle = None
+        self.close_idle()
+        if self.idle:
+            self.schedule()
+
+    def close_idle(self):
+        for key, idle in list(self.idle.items()):
+            for connection in list(idle):
+                if connection.idle_time() >= self.idle_timeout or not connection.is_usable():
+                    idle.remove(connection)
+                    connection.close()
+            if not idle:
+                del self.idle[key]
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        for idle in self.idle.values():
+            for connection in idle:
+                connection.close()
+        self.idle.clear()
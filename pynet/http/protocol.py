@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import traceback
+from collections import deque
+
+from pynet.http import HTTP_CONNECTION_CONTINUE, HTTP_CONNECTION_UPGRADE
+from pynet.http.exceptions import HTTPError, HTTPStreamEnd
+from pynet.http.header import HTTPRequestHeader
+from pynet.http.response import send_response, send_error
+from pynet.http.tools import log_response, stream_sender, write_data, HTTPChunkedDecoder
+
+
+class HTTPProtocolWriter:
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.transport = protocol.transport
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    async def drain(self):
+        await self.protocol.drain()
+
+    def close(self):
+        self.transport.close()
+
+
+class HTTPPendingRequest:
+    def __init__(self, header, size=0, error=None, chunked=False):
+        self.header = header
+        self.remaining = size
+        self.decoder = HTTPChunkedDecoder() if chunked else None
+        self.chunks = deque()
+        self.finished = not chunked and size == 0
+        self.error = error
+        self.waiter = None
+
+    def feed(self, data):
+        self.chunks.append(data)
+        self.remaining -= len(data)
+        if self.remaining <= 0:
+            self.finished = True
+        self.wakeup()
+
+    def decode(self, buffer):
+        try:
+            chunks = self.decoder.decode(buffer)
+        except HTTPError as exc:
+            self.abort(exc)
+            return 0
+        self.chunks.extend(chunks)
+        self.finished = self.decoder.finished
+        self.wakeup()
+        return sum(len(data) for data in chunks)
+
+    def abort(self, error=None):
+        if not self.finished:
+            self.finished = True
+            self.error = error or HTTPStreamEnd()
+        self.wakeup()
+
+    def wakeup(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def write_to(self, handler, protocol):
+        while True:
+            while self.chunks:
+                data = self.chunks.popleft()
+                protocol.consumed(len(data))
+                await write_data(handler, data)
+            if self.finished:
+                if self.error:
+                    raise self.error
+                return
+            self.waiter = asyncio.get_event_loop().create_future()
+            await self.waiter
+            self.waiter = None
+
+
+class HTTPProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.writer = None
+        self.addr = None
+        self.buffer = bytearray()
+        self.buffered = 0
+        self.requests = deque()
+        self.receiving = None
+        self.upgrading = False
+        self.stopped = False
+        self.stream_handler = None
+        self.worker = None
+        self.request_waiter = None
+        self.drain_waiter = None
+        self.read_paused = False
+        self.write_paused = False
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.transport.set_write_buffer_limits(high=self.server.write_high_water)
+        self.writer = HTTPProtocolWriter(self)
+        self.addr = transport.get_extra_info('peername')
+        self.worker = asyncio.ensure_future(self.process())
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self.receiving is not None:
+            self.receiving.abort()
+            self.receiving = None
+        self.wakeup_worker()
+        if self.drain_waiter is not None and not self.drain_waiter.done():
+            self.drain_waiter.set_exception(ConnectionResetError("Connection lost"))
+        if self.stream_handler is not None:
+            self.stream_handler.error()
+            self.worker.cancel()
+
+    def data_received(self, data):
+        if self.stream_handler is not None:
+            self.stream_handler.feed(data)
+            return
+        self.buffer += data
+        self.parse()
+        self.update_reading()
+
+    def eof_received(self):
+        if self.stream_handler is not None:
+            self.stream_handler.error()
+            self.worker.cancel()
+            return False
+        if self.receiving is not None:
+            self.receiving.abort()
+            self.receiving = None
+        self.stopped = True
+        self.wakeup_worker()
+        return self.transport.get_extra_info("sslcontext") is None
+
+    def parse(self):
+        while not self.closed:
+            if self.receiving is not None:
+                if not self.buffer:
+                    return
+                if self.receiving.decoder is not None:
+                    self.buffered += self.receiving.decode(self.buffer)
+                    if self.receiving.error is not None:
+                        self.stopped = True
+                else:
+                    size = min(len(self.buffer), self.receiving.remaining)
+                    self.receiving.feed(bytes(self.buffer[:size]))
+                    self.buffered += size
+                    del self.buffer[:size]
+                if not self.receiving.finished:
+                    return
+                self.receiving = None
+                continue
+
+            if self.upgrading or self.stopped:
+                return
+            end = self.buffer.find(b"\r\n\r\n")
+            if end < 0 or end + 4 > self.server.max_header_size:
+                if end >= 0 or len(self.buffer) > self.server.max_header_size:
+                    self.queue_request(HTTPPendingRequest(None, error=HTTPError(431)))
+                return
+
+            head = bytes(self.buffer[:end + 4])
+            del self.buffer[:end + 4]
+            try:
+                header = HTTPRequestHeader().parse(head)
+                size = header.fields.get("Content-Length", 0, int)
+            except HTTPError as exc:
+                self.queue_request(HTTPPendingRequest(None, error=exc))
+                return
+            except ValueError:
+                self.queue_request(HTTPPendingRequest(None, error=HTTPError(400)))
+                return
+
+            request = HTTPPendingRequest(header, size, chunked=header.chunked())
+            self.queue_request(request)
+            if not request.finished:
+                self.receiving = request
+            if header.upgraded():
+                self.upgrading = True
+
+    def queue_request(self, request):
+        if request.error is not None:
+            self.stopped = True
+        self.requests.append(request)
+        self.wakeup_worker()
+
+    def wakeup_worker(self):
+        if self.request_waiter is not None and not self.request_waiter.done():
+            self.request_waiter.set_result(None)
+
+    def consumed(self, size):
+        self.buffered -= size
+        self.update_reading()
+
+    def update_reading(self):
+        if self.closed or self.stream_handler is not None:
+            return
+        pause = self.write_paused or len(self.buffer) + self.buffered > self.server.max_buffer
+        if pause and not self.read_paused:
+            self.read_paused = True
+            self.transport.pause_reading()
+        elif not pause and self.read_paused:
+            self.read_paused = False
+            self.transport.resume_reading()
+
+    def pause_writing(self):
+        self.write_paused = True
+        self.update_reading()
+
+    def resume_writing(self):
+        self.write_paused = False
+        if self.drain_waiter is not None and not self.drain_waiter.done():
+            self.drain_waiter.set_result(None)
+        self.update_reading()
+
+    async def drain(self):
+        if self.closed:
+            raise ConnectionResetError("Connection lost")
+        if not self.write_paused:
+            return
+        self.drain_waiter = asyncio.get_event_loop().create_future()
+        try:
+            await self.drain_waiter
+        finally:
+            self.drain_waiter = None
+
+    async def next_request(self):
+        while not self.requests:
+            if self.closed or self.stopped:
+                return None
+            self.request_waiter = asyncio.get_event_loop().create_future()
+            await self.request_waiter
+            self.request_waiter = None
+        return self.requests.popleft()
+
+    async def process(self):
+        try:
+            while True:
+                request = await self.next_request()
+                if request is None or not await self.handle(request):
+                    break
+        finally:
+            self.transport.close()
+
+    def resume_parsing(self):
+        if self.upgrading:
+            self.upgrading = False
+            self.parse()
+            self.update_reading()
+
+    async def upgrade(self, stream_handler):
+        self.stream_handler = stream_handler
+        if self.read_paused:
+            self.read_paused = False
+            self.transport.resume_reading()
+        data, self.buffer = bytes(self.buffer), bytearray()
+        if data:
+            self.stream_handler.feed(data)
+        await stream_sender(self.writer, stream_handler)
+
+    async def handle(self, request):
+        handler = None
+        header = request.header
+        try:
+            if request.error is not None:
+                raise request.error
+            if not header.is_valid():
+                raise HTTPError(400)
+
+            handler_construct, user_data, regex = self.server.router.get_route(header.url.path)
+            header.url.regex = regex
+            handler = handler_construct(header, user_data, self.addr, self.server)
+
+            prepare_return = await handler.prepare()
+
+            if prepare_return == HTTP_CONNECTION_CONTINUE:
+                body_complete = await handler.process(request.write_to(handler, self))
+                self.resume_parsing()
+
+                response = await handler.prepare_response()
+                if not header.keep_alive() or not body_complete:
+                    response.header.fields.set("Connection", "close")
+                log_response(logging.info, self.addr, response, handler)
+                await send_response(self.writer, response, self.server.write_high_water)
+
+            elif prepare_return == HTTP_CONNECTION_UPGRADE:
+                response = await handler.prepare_response()
+                await send_response(self.writer, response, self.server.write_high_water)
+                log_response(logging.info, self.addr, handler.response, handler)
+                await self.upgrade(handler.stream_handler)
+                return False
+
+            else:
+                raise HTTPError(500)
+
+            return header.keep_alive() and body_complete
+
+        except (ConnectionResetError, BrokenPipeError, HTTPStreamEnd):
+            if self.stream_handler and not self.closed:
+                self.stream_handler.error()
+
+        except HTTPError as exc:
+            response = await send_error(self.writer, exc.code, self.server, handler)
+            log_response(logging.warning, self.addr, response, handler)
+
+        except Exception:
+            response = await send_error(self.writer, 500, self.server, handler, data=traceback.format_exc())
+            log_response(logging.exception, self.addr, response, handler)
+
+        finally:
+            if handler is not None:
+                handler.close()
+
+        return False
@@ -1,13 +1,16 @@
+import asyncio
 import codecs
 import gzip
+import inspect
 import io
 import json
-import shutil
 
 from mako.runtime import Context
 
+from pynet.http import CHUNK_SIZE, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, COMPRESS_LEVEL, WRITE_HIGH_WATER
+from pynet.http.data import HTTPByteRangesSender, HTTPStreamSender
 from pynet.http.header import HTTPResponseHeader
-from pynet.http.tools import get_file_length
+from pynet.http.tools import get_file_length, http_date, parse_http_date, etag_match, is_compressible, parse_range
 
 
 class HTTPResponse:
@@ -15,15 +18,20 @@ class HTTPResponse:
         self.header = HTTPResponseHeader()
         self.data = None
         self.data_seek = 0
+        self.data_length = None
         self.prevent_close = False
+        self.etag = None
+        self.mtime = None
 
     def upgrade_connection(self, name):
         self.header.fields.set("Connection", "Upgrade")
         self.header.fields.set("Upgrade", name)
 
-    def upgrade_websocket(self, key):
+    def upgrade_websocket(self, key, extensions=None):
         self.upgrade_connection("websocket")
         self.header.fields.set("Sec-WebSocket-Accept", key.decode())
+        if extensions:
+            self.header.fields.set("Sec-WebSocket-Extensions", extensions)
         self.header.code = 101
         return self
 
@@ -49,6 +57,42 @@ class HTTPResponse:
         self.prevent_close = prevent_close
         return self
 
+    def set_validators(self, etag=None, mtime=None):
+        self.etag = etag
+        self.mtime = mtime
+        if etag:
+            self.header.fields.set("ETag", etag)
+        if mtime is not None:
+            self.header.fields.set("Last-Modified", http_date(mtime))
+        return self
+
+    def is_not_modified(self, fields):
+        if self.header.code != 200:
+            return False
+        none_match = fields.get("If-None-Match")
+        if none_match is not None:
+            return self.etag is not None and etag_match(none_match, self.etag)
+        since = fields.get("If-Modified-Since")
+        if since is None or self.mtime is None:
+            return False
+        since = parse_http_date(since)
+        return since is not None and int(self.mtime) <= since
+
+    def check_if_range(self, value):
+        if value is None:
+            return True
+        value = value.strip()
+        if value.startswith('"') or value.startswith("W/"):
+            return self.etag is not None and etag_match(value, self.etag, weak=False)
+        date = parse_http_date(value)
+        return date is not None and self.mtime is not None and int(self.mtime) == date
+
+    def not_modified(self):
+        self.close()
+        self.data = None
+        self.header.code = 304
+        return self
+
     def render(self, code, template, **kwargs):
         self.text(code, "", content_type="text/html")
         wrapper_file = codecs.getwriter('utf-8')(self.data)
@@ -65,50 +109,215 @@ class HTTPResponse:
             json.dump(data, wrapper_file, allow_nan=False)
         return self
 
+    def stream(self, code, source, content_type="application/octet-stream"):
+        self.header.code = code
+        self.header.fields.set("Content-type", content_type)
+        self.data = HTTPStreamSender(source)
+        return self
+
     def custom_data(self, code, custom):
         self.data = custom
         self.header.code = code
         self.header.fields.set("Content-type", self.data.get_content_type())
         return self
 
-    def compress_gzip(self):
+    def compress_gzip(self, level=COMPRESS_LEVEL):
         if not isinstance(self.data, io.BytesIO):
             return
+        if "Content-Encoding" in self.header.fields or not is_compressible(self.header.fields.get("Content-Type")):
+            return
 
         self.header.fields.set("Content-Encoding", "gzip")
-        compressed = io.BytesIO()
-        compress_wrapper = gzip.GzipFile(fileobj=compressed, mode="wb")
-        self.data.seek(0)
-        shutil.copyfileobj(self.data, compress_wrapper)
-        self.data = compressed
+        self.header.fields.set("Vary", "Accept-Encoding")
+        if self.etag:
+            self.etag = self.etag[:-1] + '-gzip"'
+            self.header.fields.set("ETag", self.etag)
+        self.data = io.BytesIO(gzip.compress(self.data.getbuffer(), compresslevel=level))
 
     def set_length(self, rng=None):
+        if self.header.code == 304:
+            self.header.fields.remove("Content-Length")
+            return
         if not self.data:
             self.header.fields.set("Content-Length", 0)
             return
+        if self.is_streaming():
+            self.header.fields.remove("Content-Length")
+            self.header.fields.set("Transfer-Encoding", "chunked")
+            return
         if not isinstance(self.data, io.IOBase):
             self.header.fields.set("Content-Length", self.data.get_size())
             return
 
         full_size = get_file_length(self.data)
         self.header.fields.set("Content-Length", full_size)
-        if rng:
-            seek = int(rng.split("=")[1][:-1])
-            size = full_size - seek
-            self.header.fields.set("Content-Range", "bytes "+str(seek)+"-"+str(full_size-1)+"/"+str(full_size))
-            self.header.fields.set("Content-Length", size)
-            self.header.code = 206
-            self.data_seek = seek
+        self.data_length = full_size
+        if not rng:
+            return
+
+        ranges = parse_range(rng, full_size)
+        if ranges is None:
+            return
+        if not ranges:
+            self.close()
+            self.data = None
+            self.data_length = None
+            self.header.code = 416
+            self.header.fields.set("Content-Range", "bytes */"+str(full_size))
+            self.header.fields.set("Content-Length", 0)
+            return
+
+        self.header.code = 206
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.header.fields.set("Content-Range", "bytes "+str(start)+"-"+str(end)+"/"+str(full_size))
+            self.header.fields.set("Content-Length", end - start + 1)
+            self.data_seek = start
+            self.data_length = end - start + 1
+            return
+
+        content_type = self.header.fields.get("Content-Type")
+        self.data = HTTPByteRangesSender(self.data, ranges, full_size, content_type)
+        self.data_seek = 0
+        self.data_length = None
+        self.header.fields.set("Content-Type", self.data.get_content_type())
+        self.header.fields.set("Content-Length", self.data.get_size())
+
+    def is_streaming(self):
+        return isinstance(self.data, HTTPStreamSender)
+
+    def get_sendfile(self):
+        if not isinstance(self.data, (io.BufferedReader, io.FileIO)):
+            return None
+        if "Content-Encoding" in self.header.fields or not self.data_length:
+            return None
+        try:
+            self.data.fileno()
+        except (OSError, ValueError):
+            return None
+        return self.data
+
+    def close(self):
+        if self.data and not self.prevent_close:
+            self.data.close()
 
     def sender(self, chunk_size):
-        yield str(self.header).encode()
+        yield bytes(self.header)
+        yield from self.body_sender(chunk_size)
+
+    def body_sender(self, chunk_size):
         if self.data:
             if isinstance(self.data, io.IOBase):
-                self.data.seek(self.data_seek)
-            while True:
-                data = self.data.read(chunk_size)
-                if not data:
-                    break
-                yield data
-            if not self.prevent_close:
-                self.data.close()
+                yield from self.file_sender(chunk_size)
+            else:
+                yield from self.custom_sender(chunk_size)
+            self.close()
+
+    def file_sender(self, chunk_size):
+        self.data.seek(self.data_seek)
+        remaining = self.data_length
+        while remaining is None or remaining > 0:
+            if remaining is not None:
+                chunk_size = min(chunk_size, remaining)
+            data = self.data.read(chunk_size)
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            chunk_size = (yield data) or chunk_size
+
+    def custom_sender(self, chunk_size):
+        chunks = self.data.read(chunk_size)
+        if inspect.isgenerator(chunks):
+            yield from chunks
+            return
+        while chunks:
+            chunk_size = (yield chunks) or chunk_size
+            chunks = self.data.read(chunk_size)
+
+
+async def send_file_response(writer, response, file):
+    loop = asyncio.get_event_loop()
+    writer.write(bytes(response.header))
+    try:
+        await loop.sendfile(writer.transport, file, response.data_seek, response.data_length)
+    finally:
+        response.close()
+
+
+async def flush_response(writer, pending, chunk_size, high_water):
+    if len(pending) == 1:
+        writer.write(pending[0])
+    else:
+        writer.writelines(pending)
+    buffered = writer.transport.get_write_buffer_size()
+    if buffered > high_water:
+        await writer.drain()
+        return max(chunk_size // 2, MIN_CHUNK_SIZE)
+    if buffered == 0:
+        return min(chunk_size * 2, MAX_CHUNK_SIZE)
+    return chunk_size
+
+
+async def send_stream_response(writer, response, high_water):
+    pending = [bytes(response.header)]
+    try:
+        async for data in response.data.chunks():
+            if not data:
+                continue
+            pending += [b"%x\r\n" % len(data), data, b"\r\n"]
+            await flush_response(writer, pending, CHUNK_SIZE, high_water)
+            pending = []
+        pending.append(b"0\r\n\r\n")
+        await flush_response(writer, pending, CHUNK_SIZE, high_water)
+    finally:
+        response.close()
+
+
+async def send_response(writer, response, high_water=WRITE_HIGH_WATER):
+    if response.is_streaming():
+        await send_stream_response(writer, response, high_water)
+        return
+
+    file = response.get_sendfile()
+    if file is not None and writer.get_extra_info("sslcontext") is None and hasattr(asyncio.AbstractEventLoop, "sendfile"):
+        await send_file_response(writer, response, file)
+        return
+
+    chunk_size = CHUNK_SIZE
+    pending = [bytes(response.header)]
+    pending_size = len(pending[0])
+    body = response.body_sender(chunk_size)
+    try:
+        data = next(body)
+        while True:
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= chunk_size:
+                chunk_size = await flush_response(writer, pending, chunk_size, high_water)
+                pending, pending_size = [], 0
+            data = body.send(chunk_size)
+    except StopIteration:
+        pass
+    if pending:
+        await flush_response(writer, pending, chunk_size, high_water)
+
+
+async def send_error(writer, code, server, handler=None, data=None):
+    if handler:
+        response = handler.response
+    else:
+        response = HTTPResponse()
+        response.header.fields.add_fields(server.base_fields)
+    try:
+        response.error(code, data=data)
+        response.header.fields.set("Connection", "close")
+        if handler:
+            response = await handler.prepare_response()
+        else:
+            response.set_length()
+        await send_response(writer, response, server.write_high_water)
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        return response
@@ -1,50 +1,36 @@
 import asyncio
+import heapq
 import logging
 import re
 import traceback
+from collections import OrderedDict
 
 import pythread
 from mako.lookup import TemplateLookup
 from pythread.modes import ProcessMode
 
-from pynet.http import CHUNK_SIZE, PYNET_VERSION, HTTP_CONNECTION_CONTINUE, HTTP_CONNECTION_UPGRADE
+from pynet.http import PYNET_VERSION, ROUTER_CACHE_SIZE, MAX_HEADER_SIZE, MAX_READ_BUFFER, WRITE_HIGH_WATER, \
+    SPOOL_SIZE, MAX_CHUNKED_BODY, HTTP_CONNECTION_CONTINUE, HTTP_CONNECTION_UPGRADE
+from pynet.http.cache import CachedFilesManager
 from pynet.http.exceptions import HTTPError, HTTPStreamEnd
 from pynet.http.handler import HTTP404handler
 from pynet.http.header import HTTPRequestHeader
-from pynet.http.response import HTTPResponse
+from pynet.http.protocol import HTTPProtocol
+from pynet.http.response import send_response, send_error
 from pynet.http.session import HTTPSessionManager
-from pynet.http.tools import log_response, CachedFilesManager, stream_reader, stream_sender, get_header, get_data
-
-
-async def send_response(writer, response):
-    for data in response.sender(CHUNK_SIZE):
-        writer.write(data)
-        await writer.drain()
-
-
-async def send_error(writer, code, server, handler=None, data=None):
-    if handler:
-        response = handler.response
-    else:
-        response = HTTPResponse()
-        response.header.fields.add_fields(server.base_fields)
-    try:
-        response.error(code, data=data)
-        response = await handler.prepare_response()
-        await send_response(writer, response)
-    except (ConnectionResetError, BrokenPipeError):
-        pass
-    finally:
-        return response
+from pynet.http.tools import log_response, stream_reader, stream_sender, get_header, get_data, \
+    get_chunked_data, create_server_ssl_context
 
 
 async def http_worker(reader, writer, server):
     addr = writer.get_extra_info('peername')
+    writer.transport.set_write_buffer_limits(high=server.write_high_water)
     handler = None
     stream_handler = None
+    body_complete = True
     try:
         while True:
-            header = await get_header(reader, HTTPRequestHeader)
+            header = await get_header(reader, HTTPRequestHeader, max_size=server.max_header_size)
             if not header.is_valid():
                 raise HTTPError(400)
 
@@ -56,18 +42,21 @@ async def http_worker(reader, writer, server):
 
             if prepare_return == HTTP_CONNECTION_CONTINUE:
 
-                data_count = header.fields.get("Content-Length", 0, int)
-
-                await get_data(reader, handler, data_count)
+                if header.chunked():
+                    receive = get_chunked_data(reader, handler)
+                else:
+                    receive = get_data(reader, handler, header.fields.get("Content-Length", 0, int))
+                body_complete = await handler.process(receive)
 
-                await handler.execute_request()
                 response = await handler.prepare_response()
+                if not header.keep_alive() or not body_complete:
+                    response.header.fields.set("Connection", "close")
                 log_response(logging.info, addr, response, handler)
-                await send_response(writer, response)
+                await send_response(writer, response, server.write_high_water)
 
             elif prepare_return == HTTP_CONNECTION_UPGRADE:
                 response = await handler.prepare_response()
-                await send_response(writer, response)
+                await send_response(writer, response, server.write_high_water)
                 log_response(logging.info, addr, handler.response, handler)
                 stream_handler = handler.stream_handler
                 await asyncio.gather(stream_sender(writer, stream_handler),
@@ -76,8 +65,9 @@ async def http_worker(reader, writer, server):
             else:
                 raise HTTPError(500)
 
-            if not header.keep_alive():
+            if not header.keep_alive() or not body_complete:
                 break
+            handler.close()
             handler = None
 
     except (ConnectionResetError, BrokenPipeError, HTTPStreamEnd):
@@ -93,40 +83,124 @@ async def http_worker(reader, writer, server):
         log_response(logging.exception, addr, response, handler)
 
     finally:
+        if handler is not None:
+            handler.close()
         writer.close()
 
 
+ROUTE_META_CHARS = set(".^$*+?{}[]\\|()")
+ROUTE_QUANTIFIERS = set("*+?{")
+
+
+def route_prefix(reg_path):
+    if "|" in reg_path:
+        return ""
+    for i, char in enumerate(reg_path):
+        if char in ROUTE_META_CHARS:
+            if char in ROUTE_QUANTIFIERS:
+                return reg_path[:max(i - 1, 0)]
+            return reg_path[:i]
+    return reg_path
+
+
+def route_segment(path):
+    if not path.startswith("/"):
+        return None
+    end = path.find("/", 1)
+    if end < 0:
+        return None
+    return path[1:end]
+
+
 class HTTPRouter:
-    def __init__(self):
+    def __init__(self, cache_size=ROUTER_CACHE_SIZE):
         self.route = []
         self.user_data = {}
+        self.literals = {}
+        self.buckets = {}
+        self.wildcards = []
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
 
     def get_route(self, path):
-        for reg_path, handler, user_data in self.route:
-            m = re.fullmatch(reg_path, path)
+        cached = self.cache.get(path)
+        if cached is not None:
+            self.cache.move_to_end(path)
+            return cached[0], cached[1], list(cached[2])
+
+        match = self.match_route(path)
+        self.cache[path] = match
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return match[0], match[1], list(match[2])
+
+    def match_route(self, path):
+        literal = self.literals.get(path)
+        limit = literal if literal is not None else len(self.route)
+
+        for index, compiled, prefix in self.candidates(path):
+            if index >= limit:
+                break
+            if not path.startswith(prefix):
+                continue
+            m = compiled.fullmatch(path)
             if m is not None:
-                user_data.update(self.user_data)
+                _, handler, user_data = self.route[index]
                 regex = []
                 for group in m.groups():
-                    if len(group) == 0:
+                    if not group:
                         group = None
                     regex.append(group)
-                return handler, user_data, regex
-        return HTTP404handler, [], []
+                return handler, user_data, tuple(regex)
+
+        if literal is not None:
+            _, handler, user_data = self.route[literal]
+            return handler, user_data, ()
+        return HTTP404handler, [], ()
+
+    def candidates(self, path):
+        bucket = self.buckets.get(route_segment(path))
+        if not bucket:
+            return self.wildcards
+        if not self.wildcards:
+            return bucket
+        return heapq.merge(bucket, self.wildcards)
 
     def add_user_data(self, name, value):
         self.user_data[name] = value
+        for _, _, user_data in self.route:
+            user_data[name] = value
+        self.cache.clear()
 
     def add_route(self, reg_path, handler, user_data=None, ws=None):
         if not user_data:
             user_data = {}
         if ws is not None:
             user_data["#ws_room"] = ws
+        user_data.update(self.user_data)
+
+        index = len(self.route)
         self.route.append((reg_path, handler, user_data))
+        self.cache.clear()
+
+        prefix = route_prefix(reg_path)
+        if prefix == reg_path:
+            self.literals.setdefault(reg_path, index)
+            return
+
+        entry = (index, re.compile(reg_path), prefix)
+        segment = route_segment(prefix)
+        if segment is None:
+            self.wildcards.append(entry)
+        else:
+            self.buckets.setdefault(segment, []).append(entry)
 
 
 class HTTPServer:
-    def __init__(self, port=8080, loop=None, template_dir="template/", cache_size=100):
+    def __init__(self, port=8080, loop=None, template_dir="template/", cache_size=100,
+                 max_header_size=MAX_HEADER_SIZE, engine="stream", max_buffer=MAX_READ_BUFFER,
+                 write_high_water=WRITE_HIGH_WATER, spool_size=SPOOL_SIZE, spool_dir=None, max_body_size=None,
+                 max_chunked_body=MAX_CHUNKED_BODY, ssl=None):
         if not loop:
             loop = asyncio.get_event_loop()
 
@@ -138,6 +212,19 @@ class HTTPServer:
         self.loop = loop
         self.server = None
         self.port = port
+        self.max_header_size = max_header_size
+        self.engine = engine
+        self.max_buffer = max_buffer
+        self.write_high_water = write_high_water
+        self.spool_size = spool_size
+        self.spool_dir = spool_dir
+        self.max_body_size = max_body_size
+        self.max_chunked_body = max_chunked_body
+        if isinstance(ssl, str):
+            ssl = create_server_ssl_context(ssl)
+        elif isinstance(ssl, tuple):
+            ssl = create_server_ssl_context(*ssl)
+        self.ssl = ssl
         self.base_fields = [("Server", PYNET_VERSION)]
         pythread.create_new_mode(ProcessMode, "httpServer", size=5)
 
@@ -151,8 +238,14 @@ class HTTPServer:
         await http_worker(reader, writer, self)
 
     def start(self):
-        coro = asyncio.start_server(self.root_handler, reuse_address=True, port=self.port, loop=self.loop)
+        if self.engine == "protocol":
+            coro = self.loop.create_server(lambda: HTTPProtocol(self), reuse_address=True, port=self.port,
+                                           ssl=self.ssl)
+        else:
+            coro = asyncio.start_server(self.root_handler, reuse_address=True, port=self.port, loop=self.loop,
+                                        limit=self.max_header_size, ssl=self.ssl)
         self.server = self.loop.run_until_complete(coro)
+        self.sessionManager.start(self.loop)
         logging.info('Serving on {}'.format(self.server.sockets[0].getsockname()))
 
     def run_forever(self):
@@ -164,6 +257,7 @@ class HTTPServer:
             self.close()
 
     def close(self):
+        self.sessionManager.stop()
         self.server.close()
         self.loop.run_until_complete(self.server.wait_closed())
         pythread.close_mode("httpServer")
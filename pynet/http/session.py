@@ -1,5 +1,9 @@
+import heapq
 import time
 import uuid
+from collections import OrderedDict
+
+from pynet.http import SESSION_EXPIRE, SESSION_SWEEP_INTERVAL, MAX_SESSIONS, MAX_SESSIONS_PER_ADDR
 
 
 class HTTPSession:
@@ -10,33 +14,107 @@ class HTTPSession:
         self.last_time = time.time()
         self.expire = expire
 
-    def has_expire(self):
-        return self.last_time+self.expire < time.time()
+    def deadline(self):
+        return self.last_time+self.expire
+
+    def has_expire(self, now=None):
+        if now is None:
+            now = time.time()
+        return self.deadline() < now
 
     def prolong(self):
         self.last_time = time.time()
 
 
 class HTTPSessionManager:
-    def __init__(self, expire=60):
-        self.sessions = []
+    def __init__(self, expire=SESSION_EXPIRE, max_sessions=MAX_SESSIONS, max_per_addr=MAX_SESSIONS_PER_ADDR,
+                 sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.sessions = OrderedDict()
+        self.addresses = {}
+        self.deadlines = []
         self.expire = expire
+        self.max_sessions = max_sessions
+        self.max_per_addr = max_per_addr
+        self.sweep_interval = sweep_interval
+        self.loop = None
+        self.handle = None
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def active(self):
+        return len(self.sessions)
 
     def get_session(self, uid, addr):
         if not uid:
             return self.new_session(addr)
-        for session in self.sessions:
-            if session.has_expire():
-                self.sessions.remove(session)
-            elif session.uid == uid:
-                if session.addr == addr:
-                    session.prolong()
-                    return session
-                self.sessions.remove(session)
-        return self.new_session(addr)
+        session = self.sessions.get(uid)
+        if session is None:
+            return self.new_session(addr)
+        if session.has_expire():
+            self.remove(session)
+            self.expired += 1
+            return self.new_session(addr)
+        if session.addr != addr:
+            self.remove(session)
+            return self.new_session(addr)
+
+        session.prolong()
+        self.sessions.move_to_end(uid)
+        self.addresses[addr].move_to_end(uid)
+        return session
 
     def new_session(self, addr):
         session = HTTPSession(addr, self.expire)
-        self.sessions.append(session)
+        sessions = self.addresses.get(addr)
+        if self.max_per_addr and sessions and len(sessions) >= self.max_per_addr:
+            self.remove(self.sessions[next(iter(sessions))])
+            self.evicted += 1
+        if self.max_sessions and len(self.sessions) >= self.max_sessions:
+            self.remove(next(iter(self.sessions.values())))
+            self.evicted += 1
+
+        self.sessions[session.uid] = session
+        self.addresses.setdefault(addr, OrderedDict())[session.uid] = None
+        heapq.heappush(self.deadlines, (session.deadline(), session.uid))
+        self.created += 1
         return session
 
+    def remove(self, session):
+        if self.sessions.pop(session.uid, None) is None:
+            return
+        sessions = self.addresses.get(session.addr)
+        if sessions is not None:
+            sessions.pop(session.uid, None)
+            if not sessions:
+                del self.addresses[session.addr]
+
+    def sweep(self, now=None):
+        if now is None:
+            now = time.time()
+        while self.deadlines and self.deadlines[0][0] < now:
+            _, uid = heapq.heappop(self.deadlines)
+            session = self.sessions.get(uid)
+            if session is None:
+                continue
+            if session.has_expire(now):
+                self.remove(session)
+                self.expired += 1
+            else:
+                heapq.heappush(self.deadlines, (session.deadline(), uid))
+        if len(self.deadlines) > 2 * len(self.sessions) + 64:
+            self.deadlines = [(session.deadline(), uid) for uid, session in self.sessions.items()]
+            heapq.heapify(self.deadlines)
+
+    def start(self, loop):
+        self.loop = loop
+        self.handle = loop.call_later(self.sweep_interval, self.run)
+
+    def run(self):
+        self.sweep()
+        self.handle = self.loop.call_later(self.sweep_interval, self.run)
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
@@ -1,20 +1,24 @@
 import asyncio
 import datetime
+import email.utils
 import http
-import io
+import inspect
 import mimetypes
-import os
-import re
-import shutil
 import ssl
+import string
 from http import cookies
 
 import magic
 
-from pynet.http import CHUNK_SIZE
+from pynet.http import CHUNK_SIZE, MAX_RANGES, MAX_HEADER_SIZE
 from pynet.http.exceptions import HTTPStreamEnd, HTTPError
 
 
+COMPRESSIBLE_TYPES = {"application/json", "application/javascript", "application/x-javascript",
+                      "application/xml", "application/wasm", "application/x-sh", "application/manifest+json",
+                      "image/svg+xml", "image/x-icon", "image/bmp", "font/ttf", "font/otf"}
+
+
 def get_file_length(file):
     file.seek(0, 2)
     return file.tell()
@@ -42,6 +46,134 @@ def get_mimetype(path):
     return mime
 
 
+def is_compressible(mimetype):
+    if not mimetype:
+        return False
+    mimetype = mimetype.split(";")[0].strip().lower()
+    if mimetype.startswith("text/") or mimetype.endswith("+xml") or mimetype.endswith("+json"):
+        return True
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def parse_accept_encoding(value):
+    codings = {}
+    if not value:
+        return codings
+    for coding in value.split(","):
+        coding, _, params = coding.partition(";")
+        coding = coding.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            codings[coding] = quality
+    return codings
+
+
+def accept_encoding(codings, encoding):
+    return codings.get(encoding, codings.get("*", 0)) > 0
+
+
+def parse_range(value, full_size, max_ranges=MAX_RANGES):
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        start, end = start.strip(), end.strip()
+        if not sep or not (start + end).isascii() or not (start + end).isdigit():
+            return None
+        if not start:
+            suffix = int(end)
+            if suffix > 0 and full_size > 0:
+                ranges.append((max(full_size - suffix, 0), full_size - 1))
+            continue
+        first = int(start)
+        if end and int(end) < first:
+            return None
+        if first < full_size:
+            last = int(end) if end else full_size - 1
+            ranges.append((first, min(last, full_size - 1)))
+    if len(ranges) > max_ranges:
+        return None
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges):
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def parse_header_params(value):
+    if not value:
+        return "", {}
+    parts = []
+    current = ""
+    quoted = False
+    for char in value:
+        if char == '"':
+            quoted = not quoted
+        if char == ";" and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+
+    params = {}
+    for param in parts[1:]:
+        name, _, param_value = param.partition("=")
+        if not name.strip():
+            continue
+        param_value = param_value.strip()
+        if len(param_value) > 1 and param_value[0] == param_value[-1] == '"':
+            param_value = param_value[1:-1].replace('\\"', '"')
+        params[name.strip().lower()] = param_value
+    return parts[0].strip().lower(), params
+
+
+def http_date(timestamp):
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def make_etag(mtime, size):
+    return '"' + format(int(mtime * 1000000), "x") + "-" + format(size, "x") + '"'
+
+
+def etag_match(value, etag, weak=True):
+    if value.strip() == "*":
+        return True
+    for candidate in value.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
 def http_code_to_string(code):
     for el in http.HTTPStatus:
         if el.value == code:
@@ -50,52 +182,33 @@ def http_code_to_string(code):
 
 
 def http_parse_query(line):
-    match = re.match(r"(.*) (.*) (.*)", line.decode())
-    if match is not None:
-        return match.group(1), match.group(2), match.group(3)
-    else:
-        raise Exception("Invalid Request", str(line))
+    parts = line.split(b" ", 2)
+    if len(parts) != 3 or not parts[0] or not parts[1]:
+        raise HTTPError(400)
+    try:
+        return parts[0].decode(), parts[1].decode(), parts[2].decode()
+    except UnicodeDecodeError:
+        raise HTTPError(400)
 
 
 def http_parse_field(line):
-    match = re.match(r"(.*): (.*)", line.decode())
-    if match is not None:
-        return match.group(1), match.group(2)
-    else:
-        raise Exception("Invalid format field:", str(line))
-
-
-def create_static_file(path):
-    data = io.BytesIO()
-    with open(path, "rb") as f:
-        shutil.copyfileobj(f, data)
-    return path, data, get_mimetype(path), os.path.getmtime(path)
+    name, sep, value = line.partition(b":")
+    if not sep or not name or name != name.rstrip(b" \t"):
+        raise HTTPError(400)
+    try:
+        return name.decode("latin-1"), value.strip(b" \t").decode()
+    except UnicodeDecodeError:
+        raise HTTPError(400)
 
 
-class CachedFilesManager:
-    def __init__(self, max_size=100):
-        self.iobytes_list = []
-        self.size = 0
-        self.max_size = max_size
-
-    def get(self, path):
-        for data in self.iobytes_list:
-            if data[0] == path:
-                if data[3] < os.path.getmtime(path):
-                    self.iobytes_list.remove(data)
-                    self.size -= get_file_length(data[1])
-                    break
-                return data
-        size = os.path.getsize(path)
-        if size > self.max_size*1024*1024:
-            return path, open(path, "rb"), get_mimetype(path), os.path.getmtime(path)
-        data = create_static_file(path)
-        self.size += size
-        self.iobytes_list.append(data)
-        while self.size > self.max_size*1024*1024:
-            old_data = self.iobytes_list.pop(0)
-            self.size -= old_data[4]
-        return data
+def http_split_head(data):
+    lines = data.split(b"\r\n")
+    start = 0
+    while start < len(lines) and not lines[start]:
+        start += 1
+    if start == len(lines):
+        raise HTTPError(400)
+    return lines[start], lines[start + 1:]
 
 
 def log_response(log_fct, addr, response, handler=None):
@@ -107,22 +220,66 @@ def log_response(log_fct, addr, response, handler=None):
         log_fct("["+str(code)+"] "+http_code_to_string(code)+" "+str(addr))
 
 
-async def create_connection(host, port=80, http_type="http"):
-    port = port
-    sslctx = None
+SSL_CONTEXTS = {}
 
+
+def get_ssl_context(verify=True, cafile=None):
+    key = (verify, cafile)
+    sslctx = SSL_CONTEXTS.get(key)
+    if sslctx is None:
+        if cafile is None:
+            cafile = ssl.get_default_verify_paths().cafile
+        sslctx = ssl.create_default_context(cafile=cafile)
+        if not verify:
+            sslctx.check_hostname = False
+            sslctx.verify_mode = ssl.CERT_NONE
+        SSL_CONTEXTS[key] = sslctx
+    return sslctx
+
+
+def create_server_ssl_context(certfile, keyfile=None, password=None, alpn=("http/1.1",), tickets=True):
+    sslctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    sslctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    sslctx.load_cert_chain(certfile, keyfile, password)
+    sslctx.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE
+    if not tickets:
+        sslctx.options |= ssl.OP_NO_TICKET
+    if alpn:
+        sslctx.set_alpn_protocols(list(alpn))
+    return sslctx
+
+
+def split_host(host, http_type="http"):
+    port = 443 if http_type == "https" else 80
     if ":" in host:
-        split_host = host.split(":")
-        host = split_host[0]
-        port = int(split_host[1])
-
-    if http_type == "https":
-        paths = ssl.get_default_verify_paths()
-        sslctx = ssl.SSLContext()
-        sslctx.verify_mode = ssl.CERT_REQUIRED
-        sslctx.check_hostname = True
-        sslctx.load_verify_locations(paths.cafile)
-        port = 443
+        host, port = host.rsplit(":", 1)
+        port = int(port)
+    return host, port
+
+
+class SSLSessionContext:
+    def __init__(self, context, session):
+        self.context = context
+        self.session = session
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return self.context.wrap_bio(incoming, outgoing, server_side, server_hostname, session=self.session)
+
+
+async def create_connection(host, port=None, http_type="http", sslctx=None, session=None):
+    host, default_port = split_host(host, http_type)
+    if port is None:
+        port = default_port
+
+    if http_type == "https" and sslctx is None:
+        sslctx = get_ssl_context()
+    elif http_type != "https":
+        sslctx = None
+    if sslctx is not None and session is not None:
+        sslctx = SSLSessionContext(sslctx, session)
     return await asyncio.open_connection(ssl=sslctx, host=host, port=port)
 
 
@@ -136,39 +293,48 @@ def split_request(url):
 
 
 async def stream_reader(reader, stream_handler):
-    prev_data = b''
     while True:
         data = await reader.read(CHUNK_SIZE)
         if len(data) == 0:
             raise HTTPStreamEnd()
-        prev_data = stream_handler.feed(prev_data + data)
+        stream_handler.feed(data)
 
 
 async def stream_sender(writer, stream_handler):
     while True:
-        data = await stream_handler.queue.async_q.get()
+        data = await stream_handler.get_frame()
         if data is None:
             raise HTTPStreamEnd()
-        writer.write(data)
+        if isinstance(data, tuple):
+            writer.writelines(data)
+        else:
+            writer.write(data)
         await writer.drain()
 
 
-async def get_header(reader, header_type, timeout=None):
-    header = header_type()
-    while True:
-        try:
-            if timeout:
-                data = await asyncio.wait_for(reader.readline(), timeout=timeout)
-            else:
-                data = await reader.readline()
-        except asyncio.TimeoutError:
-            raise HTTPError(408)
-        data = data[:-2]
-        if len(data) > 0:
-            header.parse_line(data)
+async def get_header(reader, header_type, timeout=None, max_size=MAX_HEADER_SIZE):
+    try:
+        if timeout:
+            data = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=timeout)
         else:
-            break
-    return header
+            data = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.TimeoutError:
+        raise HTTPError(408)
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431)
+    except asyncio.IncompleteReadError as exc:
+        if exc.partial.strip():
+            raise HTTPError(400)
+        raise HTTPStreamEnd()
+    if len(data) > max_size:
+        raise HTTPError(431)
+    return header_type().parse(data)
+
+
+async def write_data(handler, data):
+    ret = handler.write(data)
+    if inspect.isawaitable(ret):
+        await ret
 
 
 async def get_data(reader, handler, size=None):
@@ -180,10 +346,94 @@ async def get_data(reader, handler, size=None):
         else:
             data = await reader.read(CHUNK_SIZE)
         if size:
+            if len(data) == 0:
+                raise HTTPStreamEnd()
             size -= len(data)
         if not size and len(data) == 0:
             break
-        if asyncio.iscoroutinefunction(handler.write):
-            await handler.write(data)
-        else:
-            handler.write(data)
\ No newline at end of file
+        await write_data(handler, data)
+
+
+HEX_DIGITS = string.hexdigits.encode()
+
+
+def parse_chunk_size(line):
+    size = line.split(b";", 1)[0].rstrip(b"\r\n").rstrip(b" \t")
+    if not size or size.strip(HEX_DIGITS):
+        raise HTTPError(400)
+    return int(size, 16)
+
+
+async def read_chunked(reader):
+    try:
+        while True:
+            size = parse_chunk_size(await reader.readuntil(b"\r\n"))
+            if size == 0:
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return
+            while size > 0:
+                data = await reader.read(min(size, CHUNK_SIZE))
+                if len(data) == 0:
+                    raise HTTPStreamEnd()
+                size -= len(data)
+                yield data
+            if await reader.readexactly(2) != b"\r\n":
+                raise HTTPError(400)
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400)
+    except asyncio.IncompleteReadError:
+        raise HTTPStreamEnd()
+
+
+async def get_chunked_data(reader, handler):
+    async for data in read_chunked(reader):
+        await write_data(handler, data)
+
+
+class HTTPChunkedDecoder:
+    def __init__(self, max_line=MAX_HEADER_SIZE):
+        self.state = "size"
+        self.remaining = 0
+        self.max_line = max_line
+        self.finished = False
+
+    def read_line(self, buffer):
+        end = buffer.find(b"\r\n")
+        if end < 0:
+            if len(buffer) > self.max_line:
+                raise HTTPError(400)
+            return None
+        line = bytes(buffer[:end])
+        del buffer[:end + 2]
+        return line
+
+    def decode(self, buffer):
+        chunks = []
+        while not self.finished:
+            if self.state == "data":
+                if not buffer:
+                    break
+                size = min(len(buffer), self.remaining)
+                chunks.append(bytes(buffer[:size]))
+                del buffer[:size]
+                self.remaining -= size
+                if self.remaining == 0:
+                    self.state = "end"
+            elif self.state == "end":
+                if len(buffer) < 2:
+                    break
+                if buffer[:2] != b"\r\n":
+                    raise HTTPError(400)
+                del buffer[:2]
+                self.state = "size"
+            else:
+                line = self.read_line(buffer)
+                if line is None:
+                    break
+                if self.state == "trailer":
+                    self.finished = not line
+                else:
+                    self.remaining = parse_chunk_size(line)
+                    self.state = "data" if self.remaining else "trailer"
+        return chunks
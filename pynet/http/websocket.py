@@ -1,74 +1,289 @@
+import asyncio
 import base64
 import hashlib
 import json
 import logging
 import struct
+from collections import deque
+import threading
 import time
+import zlib
 
 import janus
 from pythread import threaded
 
+from pynet.http import COMPRESS_LEVEL, WEBSOCKET_COPY_SIZE, WEBSOCKET_NUMPY_SIZE, WEBSOCKET_MAX_MESSAGE, \
+    WEBSOCKET_COMPRESS_SIZE, WEBSOCKET_QUEUE_SIZE, WEBSOCKET_CLOSE_PROTOCOL_ERROR, WEBSOCKET_CLOSE_INVALID_DATA, \
+    WEBSOCKET_CLOSE_TOO_BIG, WEBSOCKET_DROP_OLDEST, WEBSOCKET_DISCONNECT, \
+    WEBSOCKET_PING_INTERVAL, WEBSOCKET_PONG_TIMEOUT, WEBSOCKET_HEARTBEAT_RESOLUTION, WEBSOCKET_COALESCE_SIZE
+from pynet.http.exceptions import WebSocketError
+from pynet.http.tools import parse_header_params
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def webSocket_process_key(key):
     combined = key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
     return base64.b64encode(hashlib.sha1(combined.encode()).digest())
 
 
-def webSocket_parse(data):
-    opcode, data = int.from_bytes(data[:1], byteorder='big'), data[1:]
-    fin = (int(0xF0) & opcode) >> 7
-    opcode = int(0x0F) & opcode
+def webSocket_mask(data, mask):
+    length = len(data)
+    if not length:
+        return b""
+    if numpy is not None and length >= WEBSOCKET_NUMPY_SIZE:
+        key = numpy.frombuffer(mask * (length // 4 + 1), dtype=numpy.uint8, count=length)
+        return numpy.bitwise_xor(numpy.frombuffer(data, dtype=numpy.uint8), key).tobytes()
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, "little") ^ int.from_bytes(key, "little")).to_bytes(length, "little")
 
-    size, data = int.from_bytes(data[:1], byteorder='big'), data[1:]
-    mask_b = size >> 7
-    size -= 128
+
+def webSocket_parse(data):
+    first, second = data[0], data[1]
+    fin = first >> 7
+    opcode = first & 0x0F
+    mask_b = second >> 7
+    size = second & 0x7F
+    offset = 2
     if size == 126:
-        b_size, data = data[:2], data[2:]
-        size = int.from_bytes(b_size, byteorder='big')
+        size = int.from_bytes(data[2:4], byteorder='big')
+        offset = 4
     elif size == 127:
-        b_size, data = data[:8], data[8:]
-        size = int.from_bytes(b_size, byteorder='big')
+        size = int.from_bytes(data[2:10], byteorder='big')
+        offset = 10
 
-    mask = b""
     if mask_b == 1:
-        mask, data = data[:4], data[4:]
-
-    raw_data, data = data[:size], data[size:]
-    if mask_b == 1:
-        message_data = bytearray()
-        for i in range(0, len(raw_data)):
-            message_data.append(raw_data[i] ^ mask[i % 4])
-        message_data = bytes(message_data)
+        mask = data[offset:offset + 4]
+        offset += 4
+        message_data = webSocket_mask(data[offset:offset + size], mask)
     else:
-        message_data = raw_data
+        message_data = bytes(data[offset:offset + size])
 
-    return (fin, opcode, message_data), data
+    return (fin, opcode, message_data), data[offset + size:]
 
 
-def webSocket_compile(fin, opcode, data):
-    send_message = bytearray()
-    send_data = bytearray(data)
-    mask_b = 0
+def webSocket_header(fin, opcode, size, mask=None, rsv1=False):
+    mask_b = 0x80 if mask else 0
+    first = opcode | (fin << 7)
+    if rsv1:
+        first |= 0x40
+    if size <= 125:
+        header = struct.pack(">BB", first, size | mask_b)
+    elif size <= 0xFFFF:
+        header = struct.pack(">BBH", first, 126 | mask_b, size)
+    else:
+        header = struct.pack(">BBQ", first, 127 | mask_b, size)
+    if mask:
+        header += mask
+    return header
+
+
+def webSocket_frame(fin, opcode, data, mask=None, rsv1=False):
+    if mask:
+        data = webSocket_mask(data, mask)
+    elif isinstance(data, bytearray):
+        data = bytes(data)
+    header = webSocket_header(fin, opcode, len(data), mask, rsv1)
+    if len(data) < WEBSOCKET_COPY_SIZE:
+        return header + data
+    return header, memoryview(data)
+
+
+def webSocket_compile(fin, opcode, data, mask=None, rsv1=False):
+    frame = webSocket_frame(fin, opcode, data, mask, rsv1)
+    if isinstance(frame, tuple):
+        return b"".join(frame)
+    return frame
+
+
+def webSocket_negotiate_deflate(value, room):
+    if not value or not room.compression:
+        return None, None
+
+    for offer in value.split(","):
+        name, params = parse_header_params(offer)
+        if name != "permessage-deflate":
+            continue
+        window_bits = room.compression_window_bits
+        context_takeover = room.compression_context_takeover
+        valid = True
+        for param, param_value in params.items():
+            if param == "server_no_context_takeover" and not param_value:
+                context_takeover = False
+            elif param == "client_no_context_takeover" and not param_value:
+                pass
+            elif param in ("server_max_window_bits", "client_max_window_bits"):
+                if not param_value and param == "client_max_window_bits":
+                    continue
+                if not param_value.isdigit() or not 8 <= int(param_value) <= 15:
+                    valid = False
+                elif param == "server_max_window_bits":
+                    window_bits = min(window_bits, int(param_value))
+            else:
+                valid = False
+        if not valid or window_bits < 9:
+            continue
+
+        extension = ["permessage-deflate"]
+        if not context_takeover:
+            extension.append("server_no_context_takeover")
+        if window_bits < 15:
+            extension.append("server_max_window_bits=" + str(window_bits))
+        deflate = WebSocketDeflate(window_bits, context_takeover, room.compression_level, room.compression_threshold)
+        return deflate, "; ".join(extension)
+
+    return None, None
+
+
+class WebSocketDeflate:
+    def __init__(self, window_bits=15, context_takeover=True, level=COMPRESS_LEVEL,
+                 threshold=WEBSOCKET_COMPRESS_SIZE):
+        self.window_bits = window_bits
+        self.context_takeover = context_takeover
+        self.level = level
+        self.threshold = threshold
+        self.compressor = None
+        self.decompressor = zlib.decompressobj(-15)
+
+    def shared(self):
+        return not self.context_takeover
+
+    def compress(self, data):
+        compressor = self.compressor
+        if compressor is None:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -self.window_bits)
+            if self.context_takeover:
+                self.compressor = compressor
+        data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data.endswith(b"\x00\x00\xff\xff"):
+            data = data[:-4]
+        return data
 
-    _opcode = opcode | (fin << 7)
-    send_message.append(_opcode)
+    def decompress(self, data, max_size):
+        try:
+            data = self.decompressor.decompress(data + b"\x00\x00\xff\xff", max_size + 1)
+        except zlib.error:
+            raise WebSocketError(WEBSOCKET_CLOSE_INVALID_DATA, "invalid deflate data")
+        if len(data) > max_size:
+            raise WebSocketError(WEBSOCKET_CLOSE_TOO_BIG, "message too big")
+        return data
 
-    size = len(send_data)
-    if 125 < size <= 0xFFFF:
-        _size = 126 | mask_b << 7
-        send_message.append(_size)
-        send_message += struct.pack(">H", size)
-    elif size > 0xFFff:
-        _size = 127 | mask_b << 7
-        send_message.append(_size)
-        send_message += struct.pack(">Q", size)
-    else:
-        _size = size | mask_b << 7
-        send_message.append(_size)
 
-    send_message += send_data
+class WebSocketDecoder:
+    def __init__(self, max_message_size=WEBSOCKET_MAX_MESSAGE, require_mask=True, deflate=None):
+        self.max_message_size = max_message_size
+        self.require_mask = require_mask
+        self.deflate = deflate
+        self.buffer = bytearray()
+        self.needed = 2
+        self.fragments = []
+        self.fragment_opcode = None
+        self.fragment_size = 0
+        self.compressed = False
 
-    return send_message
+    def feed(self, data):
+        self.buffer += data
+        if len(self.buffer) < self.needed:
+            return []
+
+        messages = []
+        offset = 0
+        view = memoryview(self.buffer)
+        try:
+            while True:
+                frame = self.parse_frame(view, offset)
+                if frame is None:
+                    break
+                offset, fin, rsv1, opcode, payload = frame
+                message = self.process_frame(fin, rsv1, opcode, payload)
+                if message is not None:
+                    messages.append(message)
+        finally:
+            view.release()
+        if offset:
+            del self.buffer[:offset]
+            self.needed = max(2, self.needed - offset)
+        return messages
+
+    def parse_frame(self, view, offset):
+        available = len(view) - offset
+        if available < 2:
+            self.needed = offset + 2
+            return None
+        first, second = view[offset], view[offset + 1]
+        fin = first >> 7
+        opcode = first & 0x0F
+        masked = second >> 7
+        size = second & 0x7F
+        rsv1 = (first >> 6) & 1
+        if first & 0x30 or (rsv1 and self.deflate is None):
+            raise WebSocketError(WEBSOCKET_CLOSE_PROTOCOL_ERROR, "reserved bits set")
+        if self.require_mask and not masked:
+            raise WebSocketError(WEBSOCKET_CLOSE_PROTOCOL_ERROR, "unmasked client frame")
+
+        head = 2
+        if size == 126:
+            head = 4
+        elif size == 127:
+            head = 10
+        if masked:
+            head += 4
+        if available < head:
+            self.needed = offset + head
+            return None
+        if size == 126:
+            size = int.from_bytes(view[offset + 2:offset + 4], byteorder='big')
+        elif size == 127:
+            size = int.from_bytes(view[offset + 2:offset + 10], byteorder='big')
+
+        if opcode >= 0x08 and (not fin or size > 125):
+            raise WebSocketError(WEBSOCKET_CLOSE_PROTOCOL_ERROR, "invalid control frame")
+        if opcode < 0x08 and self.fragment_size + size > self.max_message_size:
+            raise WebSocketError(WEBSOCKET_CLOSE_TOO_BIG, "message too big")
+        if available < head + size:
+            self.needed = offset + head + size
+            return None
+
+        start = offset + head
+        if masked:
+            payload = webSocket_mask(view[start:start + size], view[start - 4:start].tobytes())
+        else:
+            payload = view[start:start + size].tobytes()
+        return start + size, fin, rsv1, opcode, payload
+
+    def process_frame(self, fin, rsv1, opcode, payload):
+        if opcode >= 0x08:
+            if rsv1:
+                raise WebSocketError(WEBSOCKET_CLOSE_PROTOCOL_ERROR, "compressed control frame")
+            return 1, opcode, payload
+        if opcode == 0x00:
+            if self.fragment_opcode is None or rsv1:
+                raise WebSocketError(WEBSOCKET_CLOSE_PROTOCOL_ERROR, "unexpected continuation frame")
+        elif self.fragment_opcode is not None:
+            raise WebSocketError(WEBSOCKET_CLOSE_PROTOCOL_ERROR, "expected continuation frame")
+        elif fin:
+            if rsv1:
+                payload = self.deflate.decompress(payload, self.max_message_size)
+            return 1, opcode, payload
+        else:
+            self.fragment_opcode = opcode
+            self.compressed = bool(rsv1)
+
+        self.fragments.append(payload)
+        self.fragment_size += len(payload)
+        if not fin:
+            return None
+        payload = b"".join(self.fragments)
+        if self.compressed:
+            payload = self.deflate.decompress(payload, self.max_message_size)
+        message = (1, self.fragment_opcode, payload)
+        self.fragments = []
+        self.fragment_opcode = None
+        self.fragment_size = 0
+        return message
 
 
 class WebSocketClient:
@@ -77,46 +292,473 @@ class WebSocketClient:
         self.request_header = header
         self.room = room
         self.server = server
-        self.queue = janus.Queue(maxsize=100, loop=server.loop)
+        self.queue = self.create_queue(room.queue_size)
+        self.closing = False
+        self.dropped = 0
+        self.last_seen = time.monotonic()
+        self.last_message = self.last_seen
+        self.ping_sent = None
+        self.deflate, self.extensions = webSocket_negotiate_deflate(
+            header.fields.get("Sec-WebSocket-Extensions"), room)
+        self.decoder = WebSocketDecoder(room.max_message_size, deflate=self.deflate)
+        self.send_lock = threading.Lock()
         self.room.new_client(self)
 
+    def create_queue(self, size):
+        return janus.Queue(maxsize=size, loop=self.server.loop)
+
     def error(self):
+        self.closing = True
         self.room.on_error(self)
 
-    def feed(self, data):
-        message, data = webSocket_parse(data)
+    def handle_message(self, message):
         self.room.exec_message(self, message)
-        return data
 
-    def send(self, fin, opcode, data, async_mode=False):
-        message = webSocket_compile(fin, opcode, data)
-        return self.queue.sync_q.put(message)
-
-    def send_text(self, text):
-        self.send(1, 1, text.encode())
-
-    def send_binary(self, binary):
-        self.send(1, 2, binary)
+    def feed(self, data):
+        if self.decoder is None:
+            return
+        self.last_seen = time.monotonic()
+        try:
+            messages = self.decoder.feed(data)
+        except WebSocketError as exc:
+            logging.warning(str(type(self.room).__name__) + " " + str(exc) + " " + str(self.addr))
+            self.reject(exc.code)
+            return
+        try:
+            for message in messages:
+                if message[1] < 0x08:
+                    self.last_message = self.last_seen
+                self.handle_message(message)
+        except WebSocketError as exc:
+            self.reject(exc.code)
+
+    def reject(self, code):
+        self.decoder = None
+        self.send(1, 8, struct.pack(">H", code))
+        self.close()
+
+    def send(self, fin, opcode, data, async_mode=False, key=None):
+        if self.deflate is None or opcode > 0x02 or len(data) < self.deflate.threshold:
+            return self.send_frame(webSocket_frame(fin, opcode, data), opcode, key)
+        with self.send_lock:
+            return self.send_frame(webSocket_frame(fin, opcode, self.deflate.compress(data), rsv1=True), opcode, key)
+
+    def send_frame(self, frame, opcode=0x01, key=None):
+        coalescer = self.room.coalescer
+        if coalescer is None:
+            return self.push(frame)
+        if opcode >= 0x08:
+            coalescer.flush_client(self)
+            return self.push(frame)
+        return coalescer.add(self, frame, key)
+
+    def put_frame(self, frame):
+        try:
+            self.queue.sync_q.put_nowait(frame)
+            return True
+        except janus.SyncQueueFull:
+            return False
+
+    def drop_frame(self):
+        try:
+            self.queue.sync_q.get_nowait()
+            return True
+        except janus.SyncQueueEmpty:
+            return False
+
+    async def get_frame(self):
+        return await self.queue.async_q.get()
+
+    def push(self, frame):
+        if self.closing:
+            return False
+        if self.put_frame(frame):
+            return True
+
+        policy = self.room.slow_consumer_policy
+        if self.deflate is not None and not self.deflate.shared():
+            policy = WEBSOCKET_DISCONNECT
+        if policy == WEBSOCKET_DROP_OLDEST:
+            if self.drop_frame() and self.put_frame(frame):
+                self.dropped += 1
+                return True
+        elif policy == WEBSOCKET_DISCONNECT:
+            logging.warning(str(type(self.room).__name__) + " slow WS_client disconnected " + str(self.addr))
+            self.disconnect()
+        self.dropped += 1
+        return False
+
+    def send_text(self, text, key=None):
+        return self.send(1, 1, text.encode(), key=key)
+
+    def send_binary(self, binary, key=None):
+        return self.send(1, 2, binary, key=key)
 
     def ping(self):
         self.send(1, 0x09, b"42")
 
     def close(self):
-        self.queue.sync_q.put(None)
+        if not self.closing:
+            if self.room.coalescer is not None:
+                self.room.coalescer.flush_client(self)
+            self.closing = True
+            if not self.put_frame(None):
+                self.drop_frame()
+                self.put_frame(None)
+
+    def disconnect(self):
+        if self.closing:
+            return
+        self.closing = True
+        while self.drop_frame():
+            pass
+        self.put_frame(None)
+
+
+class AsyncWebSocketClient(WebSocketClient):
+    def __init__(self, header, room, addr, server):
+        self.pending = deque()
+        self.worker = None
+        WebSocketClient.__init__(self, header, room, addr, server)
+
+    def create_queue(self, size):
+        return asyncio.Queue(maxsize=size)
+
+    def put_frame(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def drop_frame(self):
+        try:
+            self.queue.get_nowait()
+            return True
+        except asyncio.QueueEmpty:
+            return False
+
+    async def get_frame(self):
+        return await self.queue.get()
+
+    def send(self, fin, opcode, data, async_mode=False, key=None):
+        if self.deflate is None or opcode > 0x02 or len(data) < self.deflate.threshold:
+            return self.send_frame(webSocket_frame(fin, opcode, data), opcode, key)
+        return self.send_frame(webSocket_frame(fin, opcode, self.deflate.compress(data), rsv1=True), opcode, key)
+
+    def handle_message(self, message):
+        opcode, data = message[1], message[2]
+        if opcode == 0x09:
+            self.send(1, 0x0A, data)
+        elif opcode == 0x0A:
+            self.room.last_pong = time.time()
+        elif opcode == 0x08:
+            self.send(1, 0x08, data)
+            self.room.leave(self)
+            self.close()
+        elif opcode == 0x01:
+            try:
+                text = data.decode()
+            except UnicodeDecodeError:
+                raise WebSocketError(WEBSOCKET_CLOSE_INVALID_DATA, "invalid utf-8")
+            self.schedule(self.room.on_message, self, text)
+        elif opcode == 0x02:
+            self.schedule(self.room.on_message, self, data)
+        else:
+            raise WebSocketError(WEBSOCKET_CLOSE_PROTOCOL_ERROR, "unknown opcode")
+
+    def schedule(self, callback, *args):
+        self.pending.append((callback, args))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.process())
+
+    async def process(self):
+        while self.pending:
+            callback, args = self.pending.popleft()
+            try:
+                await callback(*args)
+            except Exception:
+                logging.exception(str(type(self.room).__name__) + " WS_client " + str(self.addr))
+
+
+class WebSocketHeartbeat:
+    def __init__(self, room, loop, ping_interval=WEBSOCKET_PING_INTERVAL, pong_timeout=WEBSOCKET_PONG_TIMEOUT,
+                 idle_timeout=None, resolution=WEBSOCKET_HEARTBEAT_RESOLUTION):
+        self.room = room
+        self.loop = loop
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.idle_timeout = idle_timeout
+        self.resolution = resolution
+        self.buckets = {}
+        self.tick = self.get_tick(time.monotonic())
+        self.handle = None
+        self.pings = 0
+        self.expired = 0
+
+    def get_tick(self, deadline):
+        return int(deadline / self.resolution)
+
+    def track(self, client):
+        self.schedule(client, client.last_seen + self.ping_interval)
+
+    def schedule(self, client, deadline):
+        tick = max(self.get_tick(deadline) + 1, self.tick + 1)
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = self.buckets[tick] = []
+        bucket.append(client)
+        if self.handle is None:
+            self.handle = self.loop.call_later(self.resolution, self.run)
+
+    def run(self):
+        self.handle = None
+        now = time.monotonic()
+        current = self.get_tick(now)
+        expired = []
+        while self.tick < current:
+            self.tick += 1
+            for client in self.buckets.pop(self.tick, ()):
+                if client.closing:
+                    continue
+                if not self.check(client, now):
+                    expired.append(client)
+
+        if expired:
+            self.expired += len(expired)
+            for client in expired:
+                client.disconnect()
+            self.room.expire(expired)
+        if self.buckets and self.handle is None:
+            self.handle = self.loop.call_later(self.resolution, self.run)
+
+    def check(self, client, now):
+        if client.ping_sent is not None:
+            if client.last_seen < client.ping_sent:
+                return False
+            client.ping_sent = None
+        if self.idle_timeout is not None and now - client.last_message >= self.idle_timeout:
+            return False
+        if now - client.last_seen >= self.ping_interval:
+            client.ping_sent = now
+            client.ping()
+            self.pings += 1
+            self.schedule(client, now + self.pong_timeout)
+        else:
+            deadline = client.last_seen + self.ping_interval
+            if self.idle_timeout is not None:
+                deadline = min(deadline, client.last_message + self.idle_timeout)
+            self.schedule(client, deadline)
+        return True
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.buckets.clear()
+
+
+class WebSocketBatch:
+    def __init__(self):
+        self.frames = []
+        self.keys = {}
+        self.size = 0
+        self.start = time.monotonic()
+
+    def add(self, frame, key=None, replace=True):
+        size = webSocket_frame_size(frame)
+        index = self.keys.get(key) if key is not None and replace else None
+        if index is not None:
+            self.size -= webSocket_frame_size(self.frames[index])
+            self.frames[index] = frame
+            self.size += size
+            return True
+        if key is not None:
+            self.keys[key] = len(self.frames)
+        self.frames.append(frame)
+        self.size += size
+        return False
+
+    def buffers(self):
+        if len(self.frames) == 1:
+            return self.frames[0]
+        buffers = []
+        for frame in self.frames:
+            if isinstance(frame, tuple):
+                buffers.extend(frame)
+            else:
+                buffers.append(frame)
+        return tuple(buffers)
+
+
+def webSocket_frame_size(frame):
+    if isinstance(frame, tuple):
+        return sum(len(buffer) for buffer in frame)
+    return len(frame)
+
+
+class WebSocketCoalescer:
+    def __init__(self, room, loop, interval, max_bytes=WEBSOCKET_COALESCE_SIZE):
+        self.room = room
+        self.loop = loop
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.batches = {}
+        self.lock = threading.Lock()
+        self.armed = False
+
+    def add(self, client, frame, key=None):
+        replace = client.deflate is None or client.deflate.shared()
+        with self.lock:
+            batch = self.batches.get(client)
+            if batch is None:
+                batch = self.batches[client] = WebSocketBatch()
+            replaced = batch.add(frame, key, replace)
+            full = batch.size >= self.max_bytes
+            if full:
+                del self.batches[client]
+            self.room.stats.coalesce(replaced)
+            arm = not full and not self.armed
+            if arm:
+                self.armed = True
+        if full:
+            return self.flush_batch(client, batch)
+        if arm:
+            self.arm()
+        return True
+
+    def arm(self):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.loop.call_later(self.interval, self.run)
+        else:
+            self.loop.call_soon_threadsafe(self.loop.call_later, self.interval, self.run)
+
+    def run(self):
+        with self.lock:
+            batches, self.batches = self.batches, {}
+            self.armed = False
+        for client, batch in batches.items():
+            self.flush_batch(client, batch)
+
+    def flush_client(self, client):
+        with self.lock:
+            batch = self.batches.pop(client, None)
+        if batch is not None:
+            self.flush_batch(client, batch)
+
+    def flush_batch(self, client, batch):
+        self.room.stats.flush(len(batch.frames), time.monotonic() - batch.start)
+        return client.push(batch.buffers())
+
+
+class WebSocketRoomStats:
+    def __init__(self):
+        self.broadcasts = 0
+        self.frames = 0
+        self.deliveries = 0
+        self.dropped = 0
+        self.fanout_total = 0.0
+        self.fanout_max = 0.0
+        self.fanout_last = 0.0
+        self.coalesced = 0
+        self.replaced = 0
+        self.flushes = 0
+        self.coalesce_total = 0.0
+        self.coalesce_max = 0.0
+
+    def add(self, frames, deliveries, dropped, elapsed):
+        self.broadcasts += 1
+        self.frames += frames
+        self.deliveries += deliveries
+        self.dropped += dropped
+        self.fanout_total += elapsed
+        self.fanout_last = elapsed
+        self.fanout_max = max(self.fanout_max, elapsed)
+
+    def coalesce(self, replaced):
+        self.coalesced += 1
+        if replaced:
+            self.replaced += 1
+
+    def flush(self, frames, latency):
+        self.flushes += 1
+        self.coalesce_total += latency
+        self.coalesce_max = max(self.coalesce_max, latency)
+
+    def frames_saved(self):
+        return self.coalesced - self.flushes
+
+    def coalesce_latency(self):
+        if not self.flushes:
+            return None
+        return self.coalesce_total / self.flushes
+
+    def fanout_mean(self):
+        if not self.broadcasts:
+            return None
+        return self.fanout_total / self.broadcasts
+
+    def __str__(self):
+        return "WebSocketRoomStats(broadcasts=" + str(self.broadcasts) + ", frames=" + str(self.frames) + \
+               ", deliveries=" + str(self.deliveries) + ", dropped=" + str(self.dropped) + \
+               ", fanout_mean=" + str(self.fanout_mean()) + ", fanout_max=" + str(self.fanout_max) + \
+               ", frames_saved=" + str(self.frames_saved()) + ", replaced=" + str(self.replaced) + \
+               ", coalesce_latency=" + str(self.coalesce_latency()) + ")"
 
 
 class WebSocketRoom:
+    client_class = WebSocketClient
+    max_message_size = WEBSOCKET_MAX_MESSAGE
+    queue_size = WEBSOCKET_QUEUE_SIZE
+    slow_consumer_policy = WEBSOCKET_DROP_OLDEST
+    ping_interval = WEBSOCKET_PING_INTERVAL
+    pong_timeout = WEBSOCKET_PONG_TIMEOUT
+    idle_timeout = None
+    heartbeat_resolution = WEBSOCKET_HEARTBEAT_RESOLUTION
+    coalesce_interval = None
+    coalesce_bytes = WEBSOCKET_COALESCE_SIZE
+    compression = False
+    compression_level = COMPRESS_LEVEL
+    compression_window_bits = 15
+    compression_context_takeover = False
+    compression_threshold = WEBSOCKET_COMPRESS_SIZE
+
     def __init__(self, name=None):
         self.clients = []
         self.name = name
         self.last_pong = time.time()
+        self.stats = WebSocketRoomStats()
+        self.heartbeat = None
+        self.coalescer = None
 
     def new_client(self, client):
         if client not in self.clients:
             self.clients.append(client)
             logging.info(str(type(self).__name__) + " new WS_client " + str(client.addr))
+            self.track(client)
             self.on_new(client)
 
+    def track(self, client):
+        if self.coalesce_interval and self.coalescer is None:
+            self.coalescer = WebSocketCoalescer(self, client.server.loop, self.coalesce_interval, self.coalesce_bytes)
+        if not self.ping_interval:
+            return
+        if self.heartbeat is None:
+            self.heartbeat = WebSocketHeartbeat(self, client.server.loop, self.ping_interval, self.pong_timeout,
+                                                self.idle_timeout, self.heartbeat_resolution)
+        self.heartbeat.track(client)
+
+    @threaded("httpServer")
+    def expire(self, clients):
+        for client in clients:
+            if client in self.clients:
+                self.on_close(client)
+                self.close(client)
+
     @threaded("httpServer")
     def exec_message(self, client, message):
         if client not in self.clients:
@@ -131,7 +773,13 @@ class WebSocketRoom:
             self.close(client)
             client.close()
         elif message[1] == 1:
-            self.on_message(client, message[2].decode())
+            try:
+                text = message[2].decode()
+            except UnicodeDecodeError:
+                logging.warning(str(type(self).__name__) + " invalid utf-8 " + str(client.addr))
+                client.reject(WEBSOCKET_CLOSE_INVALID_DATA)
+                return
+            self.on_message(client, text)
         elif message[1] == 2:
             self.on_message(client, message[2])
         else:
@@ -157,23 +805,99 @@ class WebSocketRoom:
         self.clients.remove(client)
 
     @threaded("httpServer")
-    def send(self, data, client=None):
+    def send(self, data, client=None, key=None):
         if client is None:
-            for client in self.clients:
-                self.send(data, client=client)
+            self.broadcast(data, key)
         elif client not in self.clients:
             raise Exception("client unknown")
         elif type(data) == str:
-            client.send_text(data)
-        elif type(data) == bytearray:
-            client.send_binary(data)
+            client.send_text(data, key)
+        elif type(data) in (bytes, bytearray):
+            client.send_binary(data, key)
         else:
             raise Exception("Unknown type", type(data), data)
 
+    def broadcast(self, data, key=None):
+        if type(data) == str:
+            opcode, data = 1, data.encode()
+        elif type(data) in (bytes, bytearray):
+            opcode, data = 2, bytes(data)
+        else:
+            raise Exception("Unknown type", type(data), data)
+
+        start = time.monotonic()
+        frame = None
+        compressed = {}
+        deliveries = 0
+        dropped = 0
+        for client in list(self.clients):
+            deflate = client.deflate
+            if deflate is None or len(data) < deflate.threshold:
+                if frame is None:
+                    frame = webSocket_frame(1, opcode, data)
+                delivered = client.send_frame(frame, opcode, key)
+            elif deflate.shared():
+                variant = (deflate.window_bits, deflate.level)
+                if variant not in compressed:
+                    compressed[variant] = webSocket_frame(1, opcode, deflate.compress(data), rsv1=True)
+                delivered = client.send_frame(compressed[variant], opcode, key)
+            else:
+                delivered = client.send(1, opcode, data, key=key)
+            if delivered:
+                deliveries += 1
+            else:
+                dropped += 1
+        frames = len(compressed) + (frame is not None)
+        self.stats.add(frames, deliveries, dropped, time.monotonic() - start)
+
     def ping_all(self):
         for client in self.clients:
             client.ping()
 
-    def send_json(self, data, client=None):
+    def send_json(self, data, client=None, key=None):
         data = json.dumps(data, sort_keys=True, indent=4)
-        self.send(data, client=client)
\ No newline at end of file
+        self.send(data, client=client, key=key)
+
+
+class AsyncWebSocketRoom(WebSocketRoom):
+    client_class = AsyncWebSocketClient
+
+    def new_client(self, client):
+        if client not in self.clients:
+            self.clients.append(client)
+            logging.info(str(type(self).__name__) + " new WS_client " + str(client.addr))
+            self.track(client)
+            client.schedule(self.on_new, client)
+
+    def expire(self, clients):
+        for client in clients:
+            self.leave(client)
+
+    def leave(self, client):
+        if client in self.clients:
+            self.close(client)
+            client.schedule(self.on_close, client)
+
+    def on_error(self, client):
+        self.leave(client)
+
+    async def on_message(self, client, message):
+        pass
+
+    async def on_new(self, client):
+        pass
+
+    async def on_close(self, client):
+        pass
+
+    def send(self, data, client=None, key=None):
+        if client is None:
+            self.broadcast(data, key)
+        elif client not in self.clients:
+            raise Exception("client unknown")
+        elif type(data) == str:
+            client.send_text(data, key)
+        elif type(data) in (bytes, bytearray):
+            client.send_binary(data, key)
+        else:
+            raise Exception("Unknown type", type(data), data)
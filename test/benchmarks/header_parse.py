@@ -0,0 +1,77 @@
+import asyncio
+import re
+import timeit
+
+from pynet.http.header import HTTPRequestHeader, HTTPFields, Url
+from pynet.http.tools import get_header
+
+REQUESTS = {
+    "small": b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n",
+    "browser": b"GET /js/test.js?v=42 HTTP/1.1\r\n"
+               b"Host: localhost:8080\r\n"
+               b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0\r\n"
+               b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+               b"Accept-Language: en-US,en;q=0.5\r\n"
+               b"Accept-Encoding: gzip, deflate, br\r\n"
+               b"Connection: keep-alive\r\n"
+               b"Cookie: sessionId=0123456789abcdef0123456789abcdef; test_cookie=42\r\n"
+               b"Upgrade-Insecure-Requests: 1\r\n"
+               b"If-None-Match: \"5d8f3c2a1b-1a2b\"\r\n"
+               b"Cache-Control: max-age=0\r\n\r\n",
+}
+
+
+class RegexRequestHeader:
+    def __init__(self):
+        self.query = None
+        self.fields = HTTPFields()
+
+    def parse_line(self, line):
+        if self.query is None:
+            match = re.match(r"(.*) (.*) (.*)", line.decode())
+            self.query, url, self.protocol = match.group(1), match.group(2), match.group(3)
+            self.url = Url(url)
+        else:
+            match = re.match(r"(.*): (.*)", line.decode())
+            self.fields.append((match.group(1), match.group(2)))
+
+
+async def get_header_readline(reader, header_type):
+    header = header_type()
+    while True:
+        data = await reader.readline()
+        data = data[:-2]
+        if len(data) > 0:
+            header.parse_line(data)
+        else:
+            break
+    return header
+
+
+def bench(loop, fct, header_type, data, number):
+    async def run():
+        for _ in range(number):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            await fct(reader, header_type)
+    start = timeit.default_timer()
+    loop.run_until_complete(run())
+    return (timeit.default_timer() - start) / number * 1000000
+
+
+def main(number=20000):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for name, data in REQUESTS.items():
+        old = bench(loop, get_header_readline, RegexRequestHeader, data, number)
+        new = bench(loop, get_header, HTTPRequestHeader, data, number)
+        print("%-8s readline+regex: %7.2f us   readuntil: %7.2f us   x%.2f" % (name, old, new, old / new))
+        start = timeit.default_timer()
+        for _ in range(number):
+            HTTPRequestHeader().parse(data)
+        print("%-8s parse only: %7.2f us" % (name, (timeit.default_timer() - start) / number * 1000000))
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import struct
+import timeit
+
+from pynet.http.websocket import webSocket_parse, webSocket_frame, webSocket_compile
+
+SIZES = [10, 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+MASK = b"\x12\x34\x56\x78"
+
+
+def bytewise_parse(data):
+    opcode, data = int.from_bytes(data[:1], byteorder='big'), data[1:]
+    fin = (int(0xF0) & opcode) >> 7
+    opcode = int(0x0F) & opcode
+
+    size, data = int.from_bytes(data[:1], byteorder='big'), data[1:]
+    mask_b = size >> 7
+    size &= 0x7F
+    if size == 126:
+        b_size, data = data[:2], data[2:]
+        size = int.from_bytes(b_size, byteorder='big')
+    elif size == 127:
+        b_size, data = data[:8], data[8:]
+        size = int.from_bytes(b_size, byteorder='big')
+
+    mask, data = data[:4], data[4:]
+    raw_data, data = data[:size], data[size:]
+    message_data = bytearray()
+    for i in range(0, len(raw_data)):
+        message_data.append(raw_data[i] ^ mask[i % 4])
+    return (fin, opcode, bytes(message_data)), data
+
+
+def bytewise_compile(fin, opcode, data):
+    send_message = bytearray()
+    send_data = bytearray(data)
+    send_message.append(opcode | (fin << 7))
+    size = len(send_data)
+    if 125 < size <= 0xFFFF:
+        send_message.append(126)
+        send_message += struct.pack(">H", size)
+    elif size > 0xFFff:
+        send_message.append(127)
+        send_message += struct.pack(">Q", size)
+    else:
+        send_message.append(size)
+    send_message += send_data
+    return send_message
+
+
+def bench(fct, number, *args):
+    start = timeit.default_timer()
+    for _ in range(number):
+        fct(*args)
+    return (timeit.default_timer() - start) / number * 1000000
+
+
+def main():
+    for size in SIZES:
+        payload = os.urandom(size)
+        frame = webSocket_compile(1, 2, payload, mask=MASK)
+        assert webSocket_parse(frame)[0][2] == payload
+        assert bytewise_parse(frame)[0][2] == payload if size <= 64 * 1024 else True
+
+        number = max(1, 2000000 // max(size, 1000))
+        old_number = max(1, number // 100) if size > 64 * 1024 else number
+        old = bench(bytewise_parse, old_number, frame)
+        new = bench(webSocket_parse, number, frame)
+        print("unmask  %9d B  bytewise: %12.1f us   vectorized: %10.1f us   x%.0f" % (size, old, new, old / new))
+
+        old = bench(bytewise_compile, number, 1, 2, payload)
+        new = bench(webSocket_frame, number, 1, 2, payload)
+        print("encode  %9d B  copy:     %12.1f us   header+view: %9.1f us   x%.0f" % (size, old, new, old / new))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import logging
+import os
 import time
 
 from pynet.http.handler import HTTPHandler
@@ -59,7 +60,14 @@ class RenderHandler(HTTPHandler):
 
 scripts_room = ScriptsRoom()
 
-http_server = HTTPServer(template_dir='/home/jief/workspace/pynet/test/http_server_tests/template')
+# HTTPS with a self-signed certificate:
+# openssl req -x509 -newkey rsa:2048 -nodes -days 30 -subj /CN=localhost -keyout key.pem -out cert.pem
+# PYNET_CERT=cert.pem PYNET_KEY=key.pem python main.py
+ssl_config = None
+if os.environ.get("PYNET_CERT"):
+    ssl_config = (os.environ["PYNET_CERT"], os.environ.get("PYNET_KEY"))
+
+http_server = HTTPServer(template_dir='/home/jief/workspace/pynet/test/http_server_tests/template', ssl=ssl_config)
 
 http_server.router.add_user_data("notify", scripts_room)
 http_server.router.add_route("/", MainHandler,  ws=scripts_room)
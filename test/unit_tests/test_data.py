@@ -0,0 +1,86 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from pynet.http.data import HTTPMultipartParser
+from pynet.http.exceptions import HTTPError
+
+FILE = bytes(range(256)) * 40
+BODY = (b"preamble\r\n--bound\r\n"
+        b"Content-Disposition: form-data; name=\"title\"\r\n\r\n"
+        b"hello\r\n--bound\r\n"
+        b"Content-Disposition: form-data; name=\"file\"; filename=\"a.bin\"\r\n"
+        b"Content-Type: application/octet-stream\r\n\r\n" +
+        FILE + b"\r\n--bound\r\n"
+        b"Content-Disposition: form-data; name=\"empty\"\r\n\r\n"
+        b"\r\n--bound--\r\nepilogue")
+
+
+class HTTPMultipartParserTest(unittest.TestCase):
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir)
+
+    def parse(self, step, body=BODY, **kwargs):
+        parser = HTTPMultipartParser("bound", upload_dir=self.upload_dir, **kwargs)
+        for i in range(0, len(body), step):
+            parser.feed(body[i:i + step])
+        parser.end()
+        return parser
+
+    def test_chunk_boundaries(self):
+        for step in (1, 2, 3, 7, 8, 9, 13, 64, 1000, len(BODY)):
+            parser = self.parse(step)
+            self.assertEqual([part.name for part in parser.parts], ["title", "file", "empty"], step)
+            self.assertEqual(parser.get("title").value(), "hello", step)
+            self.assertEqual(parser.get("empty").value(), "", step)
+            part = parser.get("file")
+            self.assertEqual(part.filename, "a.bin")
+            self.assertEqual(part.content_type, "application/octet-stream")
+            self.assertEqual(part.size, len(FILE), step)
+            self.assertEqual(part.stream.read(), FILE, step)
+            parser.close()
+            self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_on_part_destination(self):
+        stream = io.BytesIO()
+        parser = self.parse(100, on_part=lambda part: stream if part.is_file() else None)
+        self.assertEqual(stream.getvalue(), FILE)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+        parser.close()
+
+    def test_claim(self):
+        parser = self.parse(500)
+        path = parser.get("file").claim()
+        parser.close()
+        self.assertEqual(os.listdir(self.upload_dir), [os.path.basename(path)])
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), FILE)
+
+    def test_truncated(self):
+        parser = HTTPMultipartParser("bound", upload_dir=self.upload_dir)
+        parser.feed(BODY[:len(BODY) // 2])
+        with self.assertRaises(HTTPError) as ctx:
+            parser.end()
+        self.assertEqual(ctx.exception.code, 400)
+        parser.close()
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_max_part_size(self):
+        with self.assertRaises(HTTPError) as ctx:
+            self.parse(100, max_part_size=len(FILE) - 1)
+        self.assertEqual(ctx.exception.code, 413)
+
+    def test_max_size(self):
+        self.parse(100, max_size=len(BODY))
+        with self.assertRaises(HTTPError) as ctx:
+            self.parse(100, max_size=len(BODY) - 1)
+        self.assertEqual(ctx.exception.code, 413)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from pynet.http.header import HTTPFields, HTTPRequestHeader
+
+
+class HTTPFieldsTest(unittest.TestCase):
+    def make(self):
+        fields = HTTPFields()
+        fields.add_fields([("A", "1"), ("Set-Cookie", "x"), ("B", "2"), ("set-cookie", "y"), ("C", "3")])
+        return fields
+
+    def test_order(self):
+        fields = self.make()
+        self.assertEqual(str(fields), "A: 1\r\nSet-Cookie: x\r\nB: 2\r\nset-cookie: y\r\nC: 3\r\n")
+        self.assertEqual(fields.length(), 5)
+
+    def test_lookup(self):
+        fields = self.make()
+        self.assertEqual(fields.get("SET-COOKIE"), "x")
+        self.assertEqual(fields.get_all("Set-Cookie"), ["x", "y"])
+        self.assertEqual(fields.get("a", data_type=int), 1)
+        self.assertIsNone(fields.get("missing"))
+        self.assertIn("b", fields)
+
+    def test_set(self):
+        fields = self.make()
+        fields.set("set-cookie", "z")
+        fields.set("D", "4")
+        self.assertEqual(list(fields), [("A", "1"), ("Set-Cookie", "z"), ("B", "2"), ("C", "3"), ("D", "4")])
+
+    def test_remove(self):
+        fields = self.make()
+        fields.remove("Set-Cookie", "x")
+        self.assertEqual(fields.get_all("set-cookie"), ["y"])
+        fields.remove("b")
+        fields.remove("missing")
+        self.assertEqual(list(fields), [("A", "1"), ("set-cookie", "y"), ("C", "3")])
+        self.assertNotIn("B", fields)
+
+    def test_has_token(self):
+        header = HTTPRequestHeader().parse(b"GET / HTTP/1.1\r\nConnection: Upgrade, close\r\n\r\n")
+        self.assertTrue(header.fields.has_token("connection", "close"))
+        self.assertFalse(header.keep_alive())
+        header = HTTPRequestHeader().parse(b"GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertTrue(header.keep_alive())
+        header = HTTPRequestHeader().parse(b"GET / HTTP/1.0\r\n\r\n")
+        self.assertFalse(header.keep_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+
+import pythread
+
+from pynet.http.handler import HTTPHandler
+from pynet.http.protocol import HTTPProtocol
+from pynet.http.server import HTTPServer
+from pynet.http.websocket import AsyncWebSocketRoom
+
+
+class EchoHandler(HTTPHandler):
+    async def GET(self, url):
+        self.response.text(200, url.get("n", "get"))
+
+    async def POST(self, url):
+        self.response.text(200, self.data.read().decode())
+
+
+class HTTPProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = HTTPServer(loop=self.loop, engine="protocol")
+        self.server.router.add_route("/echo", EchoHandler)
+        self.room = AsyncWebSocketRoom()
+        self.server.router.add_route("/ws", HTTPHandler, ws=self.room)
+        self.listener = self.loop.run_until_complete(
+            self.loop.create_server(lambda: HTTPProtocol(self.server), "127.0.0.1", 0))
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+        self.loop.run_until_complete(self.listener.wait_closed())
+        pythread.close_mode("httpServer")
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 5))
+
+    async def exchange(self, data, eof=False):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(data)
+        if eof:
+            writer.write_eof()
+        response = await reader.read()
+        writer.close()
+        return response
+
+    def test_pipelining(self):
+        response = self.run_async(self.exchange(
+            b"GET /echo?n=1 HTTP/1.1\r\n\r\n"
+            b"POST /echo HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello"
+            b"GET /echo?n=3 HTTP/1.1\r\nConnection: close\r\n\r\n"))
+        self.assertEqual(response.count(b"HTTP/1.1 200 OK"), 3)
+        bodies = [part.split(b"HTTP/1.1")[0] for part in response.split(b"\r\n\r\n")[1:]]
+        self.assertEqual(bodies, [b"1", b"hello", b"3"])
+        self.assertEqual(response.count(b"Connection: close"), 1)
+
+    def test_http10_closes(self):
+        response = self.run_async(self.exchange(b"GET /echo HTTP/1.0\r\n\r\nGET /echo HTTP/1.0\r\n\r\n"))
+        self.assertEqual(response.count(b"HTTP/1.1 200 OK"), 1)
+        self.assertIn(b"Connection: close", response)
+
+    def test_bad_request_after_keep_alive(self):
+        response = self.run_async(self.exchange(b"GET /echo HTTP/1.1\r\n\r\nGARBAGE\r\n\r\n"))
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        error = response[response.index(b"HTTP/1.1 400"):]
+        self.assertIn(b"Connection: close", error)
+
+    def test_eof_after_request(self):
+        response = self.run_async(self.exchange(b"GET /echo?n=eof HTTP/1.1\r\n\r\n", eof=True))
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertTrue(response.endswith(b"eof"))
+
+    def test_eof_in_body(self):
+        response = self.run_async(self.exchange(b"POST /echo HTTP/1.1\r\nContent-Length: 10\r\n\r\nhel", eof=True))
+        self.assertEqual(response, b"")
+
+    def test_eof_after_upgrade(self):
+        async def scenario():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            writer.write(b"GET /ws HTTP/1.1\r\nHost: localhost\r\nConnection: Upgrade\r\nUpgrade: websocket\r\n"
+                         b"Sec-WebSocket-Version: 13\r\nSec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n")
+            head = await reader.readuntil(b"\r\n\r\n")
+            await asyncio.sleep(0.05)
+            clients = len(self.room.clients)
+            writer.write_eof()
+            rest = await reader.read()
+            await asyncio.sleep(0.05)
+            writer.close()
+            return head, clients, rest
+
+        head, clients, rest = self.run_async(scenario())
+        self.assertTrue(head.startswith(b"HTTP/1.1 101"))
+        self.assertEqual(clients, 1)
+        self.assertEqual(rest, b"")
+        self.assertEqual(self.room.clients, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
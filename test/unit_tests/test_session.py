@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from pynet.http.session import HTTPSessionManager
+
+
+class HTTPSessionManagerTest(unittest.TestCase):
+    def test_lookup(self):
+        manager = HTTPSessionManager()
+        session = manager.get_session(None, "a")
+        self.assertIs(manager.get_session(session.uid, "a"), session)
+        self.assertIsNot(manager.get_session(session.uid, "b"), session)
+        self.assertIsNot(manager.get_session("unknown", "a"), session)
+
+    def test_no_address_cap_by_default(self):
+        manager = HTTPSessionManager()
+        sessions = [manager.get_session(None, "nat") for _ in range(300)]
+        self.assertEqual(manager.evicted, 0)
+        for session in sessions:
+            self.assertIs(manager.get_session(session.uid, "nat"), session)
+
+    def test_max_per_addr(self):
+        manager = HTTPSessionManager(max_per_addr=2)
+        first, second, third = [manager.get_session(None, "a") for _ in range(3)]
+        other = manager.get_session(None, "b")
+        self.assertEqual(manager.evicted, 1)
+        self.assertNotIn(first.uid, manager.sessions)
+        self.assertEqual(list(manager.addresses["a"]), [second.uid, third.uid])
+        self.assertIs(manager.get_session(other.uid, "b"), other)
+
+    def test_max_per_addr_one(self):
+        manager = HTTPSessionManager(max_per_addr=1)
+        manager.get_session(None, "a")
+        session = manager.get_session(None, "a")
+        self.assertIs(manager.get_session(session.uid, "a"), session)
+        self.assertEqual(list(manager.addresses["a"]), [session.uid])
+
+    def test_max_sessions(self):
+        manager = HTTPSessionManager(max_sessions=2)
+        first = manager.get_session(None, "a")
+        second = manager.get_session(None, "b")
+        manager.get_session(first.uid, "a")
+        third = manager.get_session(None, "c")
+        self.assertNotIn(second.uid, manager.sessions)
+        self.assertNotIn("b", manager.addresses)
+        self.assertIs(manager.get_session(third.uid, "c"), third)
+        self.assertIs(manager.get_session(first.uid, "a"), first)
+
+    def test_sweep(self):
+        manager = HTTPSessionManager(expire=10)
+        manager.get_session(None, "a")
+        kept = manager.get_session(None, "b")
+        kept.last_time += 20
+        manager.sweep(time.time() + 15)
+        self.assertEqual(manager.active(), 1)
+        self.assertEqual(manager.expired, 1)
+        self.assertNotIn("a", manager.addresses)
+        self.assertIs(manager.get_session(kept.uid, "b"), kept)
+        manager.sweep(time.time() + 60)
+        self.assertEqual(manager.active(), 0)
+        self.assertEqual(manager.addresses, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+
+from pynet.http.exceptions import HTTPError
+from pynet.http.tools import parse_range, merge_ranges, parse_chunk_size, HTTPChunkedDecoder
+
+
+class ParseRangeTest(unittest.TestCase):
+    def test_single(self):
+        self.assertEqual(parse_range("bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(parse_range("bytes=90-", 100), [(90, 99)])
+        self.assertEqual(parse_range("bytes=-10", 100), [(90, 99)])
+        self.assertEqual(parse_range("bytes=50-500", 100), [(50, 99)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_range("bytes=100-", 100), [])
+        self.assertEqual(parse_range("bytes=-0", 100), [])
+
+    def test_invalid(self):
+        for value in ("items=0-9", "bytes=", "bytes=9-0", "bytes=a-b", "bytes=0", "bytes=١-٢", "bytes=+1-2"):
+            self.assertIsNone(parse_range(value, 100), value)
+
+    def test_too_many(self):
+        value = "bytes=" + ",".join(str(i * 10) + "-" + str(i * 10) for i in range(5))
+        self.assertIsNone(parse_range(value, 100, max_ranges=4))
+
+    def test_merge(self):
+        self.assertEqual(parse_range("bytes=50-59,0-9,5-20,21-30", 100), [(0, 30), (50, 59)])
+        self.assertEqual(merge_ranges([(10, 20), (0, 5), (6, 8), (15, 30)]), [(0, 8), (10, 30)])
+        self.assertEqual(merge_ranges([]), [])
+
+
+class ParseChunkSizeTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(parse_chunk_size(b"5\r\n"), 5)
+        self.assertEqual(parse_chunk_size(b"3e8;name=value\r\n"), 1000)
+        self.assertEqual(parse_chunk_size(b"A \r\n"), 10)
+
+    def test_invalid(self):
+        for line in (b"-5\r\n", b"+a\r\n", b"0x10\r\n", b"1_0\r\n", b"\r\n", b" 5\r\n", b"\xd9\xa1\r\n", b"zz\r\n"):
+            with self.assertRaises(HTTPError, msg=line) as ctx:
+                parse_chunk_size(line)
+            self.assertEqual(ctx.exception.code, 400)
+
+
+class HTTPChunkedDecoderTest(unittest.TestCase):
+    BODY = b"5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\nNEXT"
+
+    def decode(self, data, step):
+        decoder = HTTPChunkedDecoder()
+        buffer = bytearray()
+        chunks = []
+        for i in range(0, len(data), step):
+            buffer += data[i:i + step]
+            chunks += decoder.decode(buffer)
+        return decoder, buffer, b"".join(chunks)
+
+    def test_whole(self):
+        decoder, buffer, data = self.decode(self.BODY, len(self.BODY))
+        self.assertTrue(decoder.finished)
+        self.assertEqual(data, b"hello world")
+        self.assertEqual(buffer, b"NEXT")
+
+    def test_split(self):
+        for step in range(1, 12):
+            decoder, buffer, data = self.decode(self.BODY, step)
+            self.assertTrue(decoder.finished, step)
+            self.assertEqual(data, b"hello world", step)
+            self.assertEqual(buffer, b"NEXT", step)
+
+    def test_unfinished(self):
+        decoder, buffer, data = self.decode(b"5\r\nhel", 2)
+        self.assertFalse(decoder.finished)
+        self.assertEqual(data, b"hel")
+
+    def test_bad_chunk_end(self):
+        with self.assertRaises(HTTPError):
+            self.decode(b"5\r\nhelloXX0\r\n\r\n", 100)
+
+    def test_line_too_long(self):
+        decoder = HTTPChunkedDecoder(max_line=8)
+        with self.assertRaises(HTTPError):
+            decoder.decode(bytearray(b"1" * 16))
+
+
+if __name__ == "__main__":
+    unittest.main()